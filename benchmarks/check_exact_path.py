@@ -0,0 +1,90 @@
+# Regression check: aggregate() against the original pandas path (.dt.date/.dt.time bounds, chained
+# masks, groupby median) over random filter combinations on the synthetic export. Results must match
+# exactly; exits 1 on the first mismatch.
+#   python benchmarks/check_exact_path.py [rows] [combinations]
+import random
+import re
+import sys
+from datetime import time as clock, timedelta
+
+import numpy as np
+
+from synthetic import synthetic_frame
+from cycle_engine import aggregate, presort, window_rows, TAIL_QUANTILES
+
+# Plain stages, nothing memoized, so every combination runs the full pass
+PLAIN_STAGES = {'window': window_rows, 'presort': lambda df, rows, key: presort(df, rows)}
+
+def baseline(df, spec):
+    # The filter and summary as the app first computed them
+    ts = df['step_start_utc1']
+    sv_tag = df['station_name1'].astype(str).apply(lambda x: re.search(r'SV\d+', x).group(0) if re.search(r'SV\d+', x) else "Other")
+    mask = (df['mainprogram_name1'] == spec['program']) & \
+           (sv_tag.isin(spec['svs'])) & \
+           (ts.dt.date >= spec['start_date']) & \
+           (ts.dt.date <= spec['end_date']) & \
+           (ts.dt.time >= spec['hour_range'][0]) & \
+           (ts.dt.time <= spec['hour_range'][1])
+    df_filtered = df[mask]
+    df_filtered = df_filtered[(df_filtered['total_cycle_time_secs1'] >= spec['noise_range'][0]) &
+                              (df_filtered['total_cycle_time_secs1'] <= spec['noise_range'][1])]
+    present = set(df_filtered['station_name1'].unique().tolist())
+    df_final = df_filtered[~df_filtered['station_name1'].isin(spec['ignored'])]
+    grouped = df_final.groupby('station_name1', observed=True)['total_cycle_time_secs1']
+    summary = grouped.agg(['median', 'count'])
+    for name in spec['quantiles']:
+        summary[name] = grouped.quantile(TAIL_QUANTILES[name])
+    summary['share_above'] = grouped.apply(lambda v: (v > spec['goal']).mean())
+    return present, summary
+
+def random_spec(df, rng):
+    days = df['step_start_utc1'].dt.date
+    first, last = days.min(), days.max()
+    start = first + timedelta(days=rng.randint(-2, (last - first).days))
+    end = start + timedelta(days=rng.randint(0, 20))
+    h0, h1 = sorted(clock(rng.randint(0, 23), rng.choice([0, 0, 30, 59])) for _ in range(2))
+    stations = df['station_name1'].cat.categories.tolist()
+    return {
+        'program': rng.choice(df['mainprogram_name1'].cat.categories.tolist()),
+        'svs': tuple(sorted(rng.sample(['SV1', 'SV2', 'SV3', 'SV4', 'Other'], rng.randint(1, 5)))),
+        'start_date': start, 'end_date': end, 'hour_range': (h0, h1),
+        'noise_range': tuple(sorted((rng.randint(0, 200), rng.randint(100, 1000)))),
+        'ignored': tuple(rng.sample(stations, rng.randint(0, 5))),
+        'quantiles': tuple(rng.sample(list(TAIL_QUANTILES), rng.randint(0, 2))),
+        'goal': rng.choice([60, 120, 135.5]),
+    }
+
+def compare(df, spec):
+    present, expected = baseline(df, spec)
+    result = aggregate(df, ('check',), spec, stages=PLAIN_STAGES)
+    summary = result['summary'].set_index(result['summary']['station_name1'].astype(str))
+    summary['share_above'] = result['share_above']
+    expected.index = expected.index.astype(str)
+    if set(result['present']) != present:
+        return 'stations present'
+    if not summary.index.sort_values().equals(expected.index.sort_values()):
+        return 'stations in summary'
+    summary = summary.loc[expected.index]
+    for column in ['median', 'count', *spec['quantiles'], 'share_above']:
+        if not np.array_equal(summary[column].to_numpy(), expected[column].to_numpy()):
+            return column
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    combinations = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    df = synthetic_frame(rows)
+    # Whole seconds put cycles on the noise bounds and goals and give medians ties; missing cycle
+    # times drop out of both paths
+    df.loc[::3, 'total_cycle_time_secs1'] = df['total_cycle_time_secs1'][::3].round()
+    df.loc[::997, 'total_cycle_time_secs1'] = np.nan
+    rng = random.Random(0)
+    for i in range(combinations):
+        spec = random_spec(df, rng)
+        mismatch = compare(df, spec)
+        if mismatch:
+            print(f"MISMATCH in {mismatch} for {spec}")
+            sys.exit(1)
+    print(f"{combinations} filter combinations on {len(df):,} cycles: aggregate() matches the pandas path")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+# Rerun latency of concurrent sessions with the aggregation engine on the script threads (GIL-bound)
+# versus in persistent worker processes. Each rerun picks a filter window from a small set, so most
+# reruns hit cached stages and some pay for a cold presort, as in real use.
+#   python benchmarks/engine_latency.py [rows] [max_sessions] [reruns]
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, time as clock
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from synthetic import synthetic_frame
+import report_copy_5 as app
+
+WINDOWS = [(program, start, end, hours)
+           for program in ("PROG_A", "PROG_B", "PROG_C")
+           for start, end in [(date(2024, 1, 1), date(2024, 1, 31)), (date(2024, 1, 15), date(2024, 2, 29))]
+           for hours in [(clock(0, 0), clock(23, 59)), (clock(6, 0), clock(18, 0))]]
+
+def run_sessions(df, dataset_key, sessions, reruns, seed=0):
+    latencies = []
+    start = threading.Barrier(sessions)
+
+    def session(rng):
+        start.wait()
+        for _ in range(reruns):
+            program, start_date, end_date, hours = rng.choice(WINDOWS)
+            spec = {'program': program, 'svs': tuple(app.sv_tags_present(df)), 'start_date': start_date,
+                    'end_date': end_date, 'hour_range': hours, 'noise_range': (rng.randint(0, 80), rng.randint(250, 400)),
+                    'ignored': (), 'quantiles': ('P90', 'P95'), 'goal': 120}
+            t = time.perf_counter()
+            app.run_aggregate(df, dataset_key, spec)
+            latencies.append(time.perf_counter() - t)
+
+    threads = [threading.Thread(target=session, args=(random.Random(seed + i),)) for i in range(sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return np.percentile(latencies, [50, 95]) * 1000
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 5_000_000
+    max_sessions = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count() or 1
+    reruns = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+    with tempfile.TemporaryDirectory() as tmp:
+        # Served from a memory map, like a dataset the app opened from its disk cache
+        path = Path(tmp) / 'cycles.arrow'
+        feather.write_feather(synthetic_frame(rows), str(path), compression='uncompressed')
+        with pa.memory_map(str(path)) as source:
+            df = pa.ipc.open_file(source).read_all().to_pandas(split_blocks=True)
+        dataset_key = ('bench', rows)
+        frame_bytes = int(df.memory_usage(deep=True).sum())
+        # Held in the dataset cache like a loaded upload, so the script threads' stages are memoized in it
+        app.cached_dataset(dataset_key, 'bench', lambda: (frame_bytes, 1), lambda: (df, {'frame_bytes': frame_bytes}))
+        app.job_input_path(df, dataset_key)  # the Arrow file workers map, written once up front
+        print(f"{rows:,} rows, {reruns} reruns per session, p50 / p95 rerun latency (ms)")
+        print(f"{'sessions':>8}  {'script threads':>18}  {'engine processes':>18}")
+        for sessions in sorted({1, *range(2, max_sessions + 1, 2), max_sessions}):
+            results = []
+            for processes in (0, max_sessions):
+                # Fresh stage caches and workers for every run, so each starts equally cold
+                app.ENGINE_PROCESSES = processes
+                for pool in app.engine_pool():
+                    pool.shutdown()
+                app.engine_pool.clear()
+                entry = app.dataset_cache()['entries'][dataset_key]
+                entry['stages'].clear()
+                entry['stage_bytes'] = 0
+                results.append(run_sessions(df, dataset_key, sessions, reruns))
+            print(f"{sessions:>8}  " + "  ".join(f"{p50:8.0f} / {p95:7.0f}" for p50, p95 in results))
+
+if __name__ == "__main__":
+    main()
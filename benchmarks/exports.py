@@ -0,0 +1,39 @@
+# Time and size of every report format against the xlsx path, on the same selection.
+#   python benchmarks/exports.py [rows]
+import sys
+import time
+from datetime import date, time as dtime
+
+import numpy as np
+
+from synthetic import synthetic_frame
+from cycle_engine import (EXPORT_FORMATS, new_export_path, presort, presorted_band, presorted_summary,
+                          station_filter)
+from report_copy_5 import sv_tags_present
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    df = synthetic_frame(rows)
+    selection = np.arange(len(df))
+    svs = sv_tags_present(df)
+    presorted = presort(df, selection)
+    summary = presorted_summary(df, presorted, presorted_band(presorted, (0, 1000)), station_filter(df, svs), ('P90', 'P95'))
+    settings = {'program': None, 'sv_tags': svs, 'start_date': date(2024, 1, 1), 'end_date': date(2024, 3, 1),
+                'hour_range': (dtime(0, 0), dtime(23, 59)), 'noise_range': (0, 1000)}
+
+    results = {}
+    for label, (suffix, writer) in EXPORT_FORMATS.items():
+        path = new_export_path(suffix)
+        start = time.perf_counter()
+        writer(path, df, selection, summary, settings, None)
+        results[label] = (time.perf_counter() - start, path.stat().st_size)
+        path.unlink()
+
+    base_secs, base_bytes = results['Excel (.xlsx)']
+    print(f"{len(selection):,} rows")
+    for label, (secs, size) in results.items():
+        print(f"  {label:<20} {secs:7.2f}s ({base_secs / secs:5.1f}x faster)  {size / 2**20:7.1f} MB "
+              f"({size / base_bytes:.0%} of xlsx)")
+
+if __name__ == "__main__":
+    main()
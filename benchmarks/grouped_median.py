@@ -0,0 +1,50 @@
+# Per-station median/quantiles from the presorted window vs the pandas groupby it replaced, on the synthetic export.
+#   python benchmarks/grouped_median.py [rows] [stations]
+import sys
+import time
+
+import numpy as np
+
+from synthetic import synthetic_frame
+from cycle_engine import presort, presorted_band, presorted_summary, TAIL_QUANTILES
+
+def pandas_path(df, quantiles):
+    grouped = df.groupby('station_name1', observed=True)['total_cycle_time_secs1']
+    stats = grouped.agg(['median', 'count'])
+    return stats, [grouped.quantile(TAIL_QUANTILES[q]).to_numpy() for q in quantiles]
+
+def presorted_path(df, presorted, quantiles):
+    bounds = presorted_band(presorted, (-np.inf, np.inf))
+    station_keep = np.ones(len(df['station_name1'].cat.categories), dtype=bool)
+    return presorted_summary(df, presorted, bounds, station_keep, quantiles)
+
+def timed(fn, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000_000
+    stations = int(sys.argv[2]) if len(sys.argv) > 2 else 60
+    df = synthetic_frame(rows, stations)
+    all_rows = np.arange(len(df))
+    print(f"{len(df):,} cycles, {stations} stations")
+
+    for label, quantiles in [('median', ()), ('median + tails', tuple(TAIL_QUANTILES))]:
+        t_pandas, (stats, expected) = timed(lambda: pandas_path(df, quantiles))
+        print(f"  {label}: pandas {t_pandas:.3f}s")
+        for workers in (1, 4):
+            t_presort, presorted = timed(lambda: presort(df, all_rows, workers))
+            t_summary, summary = timed(lambda: presorted_path(df, presorted, quantiles))
+            identical = (np.array_equal(summary['station_name1'].astype(str), stats.index.astype(str))
+                         and np.array_equal(summary['count'].to_numpy(), stats['count'].to_numpy())
+                         and np.array_equal(summary['median'].to_numpy(), stats['median'].to_numpy())
+                         and all(np.array_equal(summary[q].to_numpy(), e) for q, e in zip(quantiles, expected)))
+            print(f"    presort x{workers}: {t_presort:.3f}s, then summary {t_summary:.4f}s per rerun "
+                  f"({t_pandas / (t_presort + t_summary):.1f}x cold), identical: {identical}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+# Peak memory of concurrent sessions sharing one loaded dataset (the server-wide dataset cache the
+# app loads through) versus each rerun receiving its own copy (st.cache_data, what it used before).
+#   python benchmarks/shared_dataset.py [rows] [sessions] [reruns]
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from functools import partial
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import streamlit as st
+
+from synthetic import synthetic_frame
+import report_copy_5 as app
+
+def run_sessions(path, mode, sessions, reruns):
+    if mode == 'shared':
+        def load(files, fingerprint):
+            return app.cached_dataset(('upload', fingerprint), path, partial(app.upload_cost, files, fingerprint),
+                                      partial(app.load_data, files, fingerprint))
+    else:
+        load = st.cache_data(lambda _files, fingerprint: app.load_data(_files, fingerprint))
+    fingerprint = app.dataset_fingerprint([open(path, 'rb')])
+    first, _ = load([open(path, 'rb')], fingerprint)  # first load, outside the measurement
+    shared = []
+    start = threading.Barrier(sessions)
+
+    def session():
+        start.wait()
+        for _ in range(reruns):
+            df, _ = load([open(path, 'rb')], fingerprint)
+            shared.append(df is first)
+            time.sleep(0.05)  # the rest of the rerun holds on to the frame
+
+    threads = [threading.Thread(target=session) for _ in range(sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(shared)
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] in ('shared', 'copied'):
+        mode, path, sessions, reruns = sys.argv[1], sys.argv[2], int(sys.argv[3]), int(sys.argv[4])
+        hits = run_sessions(path, mode, sessions, reruns)
+        print(hits, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+        return
+
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 2_000_000
+    sessions = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    reruns = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / 'cycles.parquet'
+        df = synthetic_frame(rows)
+        pq.write_table(pa.Table.from_pandas(df.drop(columns=app.TIME_KEY_COLS + ['sv_tag']), preserve_index=False), path)
+        frame_mb = df.memory_usage(deep=True).sum() / 2 ** 20
+        print(f"{rows:,} rows ({frame_mb:.0f} MB in memory), {sessions} concurrent sessions x {reruns} reruns")
+        peaks = {}
+        for mode in ('copied', 'shared'):
+            # Separate processes so each peak RSS is measured from a clean start
+            out = subprocess.run([sys.executable, __file__, mode, str(path), str(sessions), str(reruns)],
+                                 env={**os.environ, 'CYCLE_CACHE_DIR': str(Path(tmp) / mode)},
+                                 capture_output=True, text=True, check=True).stdout.split()
+            hits, peaks[mode] = int(out[-2]), int(out[-1]) / 1024
+            print(f"  {mode:<7} peak RSS {peaks[mode]:8.0f} MB, reruns served the shared frame: {hits}/{sessions * reruns}")
+        print(f"  saved {peaks['copied'] - peaks['shared']:.0f} MB ({1 - peaks['shared'] / peaks['copied']:.0%})")
+
+if __name__ == "__main__":
+    main()
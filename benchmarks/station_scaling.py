@@ -0,0 +1,42 @@
+# Scaling of the per-station aggregation with SUMMARY_WORKERS threads, 1 to N, on the synthetic export:
+# the presort behind exact medians and the summary read from it, checked against the 1-thread result.
+#   python benchmarks/station_scaling.py [rows] [max_workers]
+import os
+import sys
+import time
+
+import numpy as np
+
+from synthetic import synthetic_frame
+from cycle_engine import presort, presorted_band, presorted_summary, TAIL_QUANTILES
+
+def timed(fn, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000_000
+    max_workers = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count() or 1
+    df = synthetic_frame(rows)
+    all_rows = np.arange(len(df))
+    n_groups = len(df['station_name1'].cat.categories)
+    station_keep = np.ones(n_groups, dtype=bool)
+    print(f"{len(df):,} cycles, {n_groups} stations, {os.cpu_count()} cores")
+
+    base = None
+    for workers in sorted({1, *(2 ** k for k in range(1, max_workers.bit_length())), max_workers}):
+        t_presort, presorted = timed(lambda: presort(df, all_rows, workers))
+        bounds = presorted_band(presorted, (-np.inf, np.inf))
+        t_summary, summary = timed(lambda: presorted_summary(df, presorted, bounds, station_keep, tuple(TAIL_QUANTILES)))
+        if base is None:
+            base = t_presort, presorted['values'], summary
+        identical = np.array_equal(presorted['values'], base[1]) and summary.equals(base[2])
+        print(f"  {workers:>2} workers: presort {t_presort:.3f}s ({base[0] / t_presort:.1f}x), "
+              f"summary {t_summary:.4f}s, identical: {identical}")
+
+if __name__ == "__main__":
+    main()
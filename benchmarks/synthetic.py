@@ -0,0 +1,22 @@
+# Synthetic MES cycle export shaped like the real one, run through the app's own preprocessing
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from report_copy_5 import prepare_frame
+
+def synthetic_frame(rows, stations=60, days=60, seed=0):
+    rng = np.random.default_rng(seed)
+    names = [f"LINE1_SV{i % 4 + 1}_S{i}" for i in range(1, stations - 1)] + ["LINE1_MISC7", "PACKOUT"]
+    raw = pd.DataFrame({
+        'mainprogram_name1': rng.choice(["PROG_A", "PROG_B", "PROG_C"], rows),
+        'stepprogram_name1': rng.choice(["STEP1", "STEP2"], rows),
+        'station_name1': rng.choice(names, rows),
+        'cycle_number1': np.arange(rows),
+        'step_start_utc1': pd.Timestamp('2024-01-01') + pd.to_timedelta(rng.integers(0, days * 86400, rows), unit='s'),
+        'total_cycle_time_secs1': np.round(rng.gamma(9, 15, rows), 2),
+    })
+    return prepare_frame(raw)
@@ -0,0 +1,452 @@
+# Everything the app's worker processes run: the filter-and-aggregate pass, the report writers and
+# the export/engine job entry points. No Streamlit here, so a worker imports this module on its own
+# and never needs the server's script.
+import json
+import os
+import re
+import tempfile
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, CancelledError
+from datetime import datetime
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+import xlsxwriter
+
+# Integer keys derived at load time so the date/hour filters never build Python date/time objects
+TIME_KEY_COLS = ['day_ordinal', 'minute_tick']
+# Threads for the per-station median kernel; 1 keeps it in the calling thread. Selections smaller
+# than SUMMARY_CHUNK_ROWS per thread use fewer threads, so small ones stay single-threaded
+SUMMARY_WORKERS = int(os.environ.get('CYCLE_SUMMARY_WORKERS', min(8, os.cpu_count() or 1)))
+SUMMARY_CHUNK_ROWS = 1_000_000
+TAIL_QUANTILES = {'P75': 0.75, 'P90': 0.9, 'P95': 0.95, 'P99': 0.99}
+EXCEL_CHUNK_ROWS = 100_000
+# Rows per sheet including the header; raw data past it spills to Cleaned_Raw_Data_2, _3, ...
+EXCEL_MAX_ROWS = 1_048_576
+EXCEL_EPOCH = pd.Timestamp('1899-12-30')
+EXPORT_DIR = Path(tempfile.gettempdir()) / 'cycle_time_exports'
+# CSV chunks are compressed on the same number of threads a multi-file upload decodes on
+EXPORT_WORKERS = int(os.environ.get('CYCLE_LOAD_WORKERS', min(8, os.cpu_count() or 1)))
+
+SV_PATTERN = re.compile(r'SV\d+')
+S_NUMBER_PATTERN = re.compile(r'_S(\d+)')
+NUMBER_PATTERN = re.compile(r'(\d+)')
+
+# --- STATION NAMES ---
+def parse_s_number(text):
+    s_match = S_NUMBER_PATTERN.search(str(text))
+    return int(s_match.group(1)) if s_match else None
+
+def extract_numeric_suffix(text):
+    s_number = parse_s_number(text)
+    if s_number is not None: return s_number
+    match = NUMBER_PATTERN.search(str(text))
+    return int(match.group(1)) if match else 999
+
+def sv_tag_of(station):
+    match = SV_PATTERN.search(str(station))
+    return match.group(0) if match else "Other"
+
+def natural_station_order(station_list):
+    return sorted(station_list, key=lambda s: (extract_numeric_suffix(s), str(s)))
+
+@lru_cache(maxsize=32)
+def station_index(categories):
+    # Station metadata is a pure function of the name, so it is parsed once per category
+    # instead of once per row. Arrays are aligned to category codes with one trailing
+    # entry, so indexing with code -1 (missing station) lands on the "Other"/999 fallback.
+    names = list(categories)
+    sv_tags = [sv_tag_of(n) for n in names] + ["Other"]
+    sv_categories = sorted(set(sv_tags))
+    s_numbers = [parse_s_number(n) for n in names]
+    return {
+        'sv_categories': sv_categories,
+        'sv_code': np.array([sv_categories.index(t) for t in sv_tags], dtype=np.int16),
+        'station_key': np.array([extract_numeric_suffix(n) for n in names] + [999], dtype=np.int32),
+        's_number': np.array([-1 if n is None else n for n in s_numbers] + [-1], dtype=np.int32),
+    }
+
+# --- ROW LAYOUT: programs are contiguous blocks ordered by local day/time ---
+def day_ordinal(d):
+    return (d - datetime(1970, 1, 1).date()).days
+
+def minute_tick(t):
+    # Minute of day doubled, +1 past the minute mark: an exact stand-in for comparing .dt.time with HH:MM bounds
+    return (t.hour * 60 + t.minute) * 2 + (1 if t.second or t.microsecond else 0)
+
+def program_partitions(df):
+    # O(programs * log n): block boundaries of each program in the sorted frame
+    codes = df['mainprogram_name1'].cat.codes.to_numpy()
+    categories = df['mainprogram_name1'].cat.categories
+    edges = np.searchsorted(codes, np.arange(len(categories) + 1))
+    return {name: (int(edges[i]), int(edges[i + 1])) for i, name in enumerate(categories) if edges[i + 1] > edges[i]}
+
+def program_date_bounds(df, partitions, program, start_date, end_date):
+    start, stop = partitions.get(program, (0, 0))
+    days = df['day_ordinal'].to_numpy()[start:stop]
+    lo = start + int(np.searchsorted(days, day_ordinal(start_date), side='left'))
+    hi = start + int(np.searchsorted(days, day_ordinal(end_date), side='right'))
+    return lo, hi
+
+# --- FUSED FILTER: one row selection, frames only built on demand ---
+def station_filter(df, svs, ignored=()):
+    # SV tag and visibility are both functions of the station, so together they are one
+    # lookup table over station codes (last entry serves code -1)
+    categories = df['station_name1'].cat.categories
+    stations = station_index(tuple(categories))
+    sv_ok = np.array([tag in svs for tag in stations['sv_categories']])
+    keep = sv_ok[stations['sv_code']]
+    if ignored:
+        keep[:-1] &= ~categories.isin(list(ignored))
+    return keep
+
+def select_rows(df, lo, hi, station_keep, hour_range):
+    # Every predicate works on column views of the [lo, hi) slice and ANDs into one mask
+    codes = df['station_name1'].cat.codes.to_numpy()[lo:hi]
+    ticks = df['minute_tick'].to_numpy()[lo:hi]
+    mask = station_keep[codes]
+    mask &= ticks >= minute_tick(hour_range[0])
+    mask &= ticks <= minute_tick(hour_range[1])
+    return lo + np.flatnonzero(mask)
+
+def band_rows(df, rows, noise_range):
+    cycle_times = df['total_cycle_time_secs1'].to_numpy()[rows]
+    return rows[(cycle_times >= noise_range[0]) & (cycle_times <= noise_range[1])]
+
+def visible_rows(df, rows, station_keep):
+    return rows[station_keep[df['station_name1'].cat.codes.to_numpy()[rows]]]
+
+def summary_workers(rows, workers=SUMMARY_WORKERS):
+    return max(1, min(workers, rows // SUMMARY_CHUNK_ROWS))
+
+def bucket_by_code(codes, values, n_groups, workers=SUMMARY_WORKERS):
+    # Groups values by code without a hash groupby: counts are a bincount, buckets come from a stable
+    # (radix) argsort. Codes -1 and NaN values are dropped, as groupby does. Large inputs are cut into
+    # row chunks sorted on separate threads; each chunk's share of a code is then copied in after the
+    # earlier chunks' share, which gives exactly the buckets of one stable sort.
+    n_chunks = summary_workers(len(codes), workers)
+    edges = np.linspace(0, len(codes), n_chunks + 1).astype(np.int64)
+    parts = [None] * n_chunks
+
+    def sort_chunks(chunks):
+        for i in chunks:
+            chunk_codes, chunk_values = codes[edges[i]:edges[i + 1]], values[edges[i]:edges[i + 1]]
+            keep = (chunk_codes >= 0) & ~np.isnan(chunk_values)
+            chunk_codes, chunk_values = chunk_codes[keep], chunk_values[keep]
+            parts[i] = np.bincount(chunk_codes, minlength=n_groups), chunk_values[np.argsort(chunk_codes, kind='stable')]
+
+    for_each_group(sort_chunks, n_chunks, n_chunks)
+    chunk_counts = np.array([counts for counts, _ in parts]).reshape(n_chunks, n_groups)
+    all_counts = chunk_counts.sum(axis=0)
+    group_codes = np.flatnonzero(all_counts)
+    ends = np.cumsum(all_counts[group_codes])
+    starts = ends - all_counts[group_codes]
+    if n_chunks == 1:
+        return group_codes, starts, ends, parts[0][1]
+    buckets = np.empty(int(ends[-1]) if len(ends) else 0, dtype=values.dtype)
+    # Where chunk i's share of each code goes in the output, and where it sits in the chunk
+    targets = starts + np.cumsum(chunk_counts[:, group_codes], axis=0) - chunk_counts[:, group_codes]
+    sources = np.cumsum(chunk_counts[:, group_codes], axis=1) - chunk_counts[:, group_codes]
+
+    def place_chunks(chunks):
+        for i in chunks:
+            for g, n in enumerate(chunk_counts[i, group_codes]):
+                buckets[targets[i, g]:targets[i, g] + n] = parts[i][1][sources[i, g]:sources[i, g] + n]
+
+    for_each_group(place_chunks, n_chunks, n_chunks)
+    return group_codes, starts, ends, buckets
+
+def for_each_group(run, n_groups, workers=SUMMARY_WORKERS):
+    if workers > 1 and n_groups > 1:
+        # np.partition/np.sort release the GIL, so stations split across threads run in parallel
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(run, np.array_split(np.arange(n_groups), workers)))
+    else:
+        run(range(n_groups))
+
+def order_statistics(part, n, quantiles):
+    # part is one station's sorted cycle times. Results match pandas bit for bit:
+    # median is (a + b) / 2, other quantiles interpolate linearly
+    out = []
+    for q in quantiles:
+        position = (n - 1) * q
+        lower, upper = part[int(position)], part[min(int(position) + 1, n - 1)]
+        if q == 0.5:
+            out.append((lower + upper) / 2 if n % 2 == 0 else part[n // 2])
+        else:
+            frac = position % 1
+            out.append(lower if frac == 0 else lower + (upper - lower) * frac)
+    return out
+
+# --- PRESORTED WINDOW: per-station sorted cycle times of the program/date/hour/SV slice ---
+# Noise band, visibility and goal only cut a station's cycles by value, so against these arrays
+# each is a couple of searchsorted calls per station and every quantile is an exact index lookup.
+def presort(df, rows, workers=SUMMARY_WORKERS):
+    workers = summary_workers(len(rows), workers)
+    group_codes, starts, ends, values = bucket_by_code(
+        df['station_name1'].cat.codes.to_numpy()[rows], df['total_cycle_time_secs1'].to_numpy()[rows],
+        len(df['station_name1'].cat.categories), workers)
+
+    def run(groups):
+        for g in groups:
+            values[starts[g]:ends[g]].sort()
+
+    for_each_group(run, len(group_codes), workers)
+    return {'codes': group_codes, 'starts': starts, 'ends': ends, 'values': values}
+
+def presorted_band(presorted, noise_range):
+    # Absolute [lo, hi) offsets of each station's in-band cycles
+    values = presorted['values']
+    slices = list(zip(presorted['starts'], presorted['ends']))
+    lo = np.array([s + np.searchsorted(values[s:e], noise_range[0], side='left') for s, e in slices], dtype=np.int64)
+    hi = np.array([s + np.searchsorted(values[s:e], noise_range[1], side='right') for s, e in slices], dtype=np.int64)
+    return lo, hi
+
+def presorted_stations_present(df, presorted, bounds):
+    # Codes of an ordered station categorical are already in natural station order
+    lo, hi = bounds
+    return df['station_name1'].cat.categories[presorted['codes'][hi > lo]].tolist()
+
+def presorted_summary(df, presorted, bounds, station_keep, quantiles=()):
+    lo, hi = bounds
+    groups = np.flatnonzero((hi > lo) & station_keep[presorted['codes']])
+    counts = hi[groups] - lo[groups]
+    levels = [0.5] + [TAIL_QUANTILES[name] for name in quantiles]
+    results = np.array([order_statistics(presorted['values'][lo[g]:hi[g]], hi[g] - lo[g], levels)
+                        for g in groups]).reshape(len(groups), len(levels))
+    tails = {name: results[:, j + 1] for j, name in enumerate(quantiles)}
+    return summary_frame(df, presorted['codes'][groups], results[:, 0], counts, tails)
+
+def presorted_share_above(df, presorted, bounds, summary, goal):
+    lo, hi = bounds
+    groups = np.searchsorted(presorted['codes'], summary_codes(df, summary))
+    above = [hi[g] - lo[g] - np.searchsorted(presorted['values'][lo[g]:hi[g]], goal, side='right') for g in groups]
+    return np.array(above, dtype=np.int64) / summary['count'].to_numpy()
+
+def summary_codes(df, summary):
+    return df['station_name1'].cat.categories.get_indexer(np.asarray(summary['station_name1']))
+
+def summary_frame(df, group_codes, medians, counts, tails=None):
+    names = df['station_name1'].cat.categories[group_codes]
+    stations = station_index(tuple(df['station_name1'].cat.categories))
+    return pd.DataFrame({
+        'station_name1': pd.Categorical(names, categories=names, ordered=True),
+        'sv_tag': pd.Categorical.from_codes(stations['sv_code'][group_codes], stations['sv_categories']),
+        'median': medians,
+        'count': counts.astype(np.int64),
+        **(tails or {}),
+        'sort_key': stations['station_key'][group_codes].astype(np.int64),
+    })
+
+# --- AGGREGATE: the whole pass behind a rerun, through memoized stages ---
+def read_only(*arrays):
+    # Row-sized stage results are shared through the dataset cache: every session and rerun gets the
+    # same arrays instead of a copy, so nobody may write to them
+    for array in arrays:
+        array.flags.writeable = False
+    return arrays[0] if len(arrays) == 1 else arrays
+
+def nbytes_of(value):
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sum(nbytes_of(v) for v in value)
+    if isinstance(value, dict):
+        return sum(nbytes_of(v) for v in value.values())
+    return 0
+
+def window_rows(df, key):
+    dataset_key, program, svs, start_date, end_date, hour_range = key
+    lo, hi = program_date_bounds(df, program_partitions(df), program, start_date, end_date)
+    return read_only(select_rows(df, lo, hi, station_filter(df, svs), hour_range)), hi - lo
+
+def aggregate(df, dataset_key, spec, stages):
+    # The whole filter-and-aggregate pass behind a rerun; everything it returns is station-sized
+    window_key = (dataset_key, spec['program'], spec['svs'], spec['start_date'], spec['end_date'], spec['hour_range'])
+    window, slice_rows = stages['window'](df, window_key)
+    presorted = stages['presort'](df, window, window_key)
+    # Cutting the presorted window is a few searchsorted calls per station, so it is not cached;
+    # grouping and calculating Median are index lookups into it
+    bounds = presorted_band(presorted, spec['noise_range'])
+    summary = presorted_summary(df, presorted, bounds, station_filter(df, spec['svs'], spec['ignored']), spec['quantiles'])
+    return {
+        'present': presorted_stations_present(df, presorted, bounds),
+        'summary': summary,
+        'share_above': presorted_share_above(df, presorted, bounds, summary, spec['goal']),
+        'allocations': {
+            'Filter mask (slice)': slice_rows,
+            'Window row index': window.nbytes,
+            'Presorted cycle times': presorted['values'].nbytes,
+        },
+    }
+
+# --- REPORT WRITERS ---
+def excel_columns(chunk):
+    # Whole columns converted at once to values xlsxwriter takes as-is (None = blank cell);
+    # datetimes become Excel serial numbers so they need no per-cell conversion
+    columns = []
+    for name in chunk.columns:
+        col = chunk[name]
+        if pd.api.types.is_datetime64_any_dtype(col):
+            col = ((col.dt.tz_localize(None) if col.dt.tz is not None else col) - EXCEL_EPOCH) / pd.Timedelta(days=1)
+        columns.append(np.where(col.isna().to_numpy(), None, col.astype(object).to_numpy()).tolist())
+    return columns
+
+def write_excel_rows(sheet, first_row, chunk, datetime_format):
+    formats = [datetime_format if pd.api.types.is_datetime64_any_dtype(chunk[name]) else None for name in chunk.columns]
+    # constant_memory flushes each row as the next one starts, so rows must go out in order
+    for r, row in enumerate(zip(*excel_columns(chunk)), start=first_row):
+        for c, value in enumerate(row):
+            if value is not None:
+                sheet.write(r, c, value, formats[c])
+
+def write_excel_report(path, df, rows, summary_df, progress=None):
+    # Streams straight to disk: constant_memory keeps one row in memory per sheet and raw rows are taken
+    # from the frame a chunk at a time, so memory stays flat however many rows are exported
+    progress = progress or (lambda done, text: None)
+    raw_cols = [c for c in df.columns if c not in TIME_KEY_COLS]
+    with xlsxwriter.Workbook(path, {'constant_memory': True}) as workbook:
+        header_format = workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'})
+        datetime_format = workbook.add_format({'num_format': 'yyyy-mm-dd hh:mm:ss'})
+
+        def add_sheet(name, columns):
+            sheet = workbook.add_worksheet(name)
+            sheet.write_row(0, 0, columns, header_format)
+            return sheet
+
+        write_excel_rows(add_sheet('Summary_Stats', list(summary_df.columns)), 1, summary_df, datetime_format)
+
+        per_sheet = EXCEL_MAX_ROWS - 1
+        sheet_count = max(1, -(-len(rows) // per_sheet))
+        for index in range(sheet_count):
+            sheet = add_sheet('Cleaned_Raw_Data' + (f'_{index + 1}' if index else ''), raw_cols)
+            sheet_rows = rows[index * per_sheet:(index + 1) * per_sheet]
+            for start in range(0, len(sheet_rows), EXCEL_CHUNK_ROWS):
+                done = index * per_sheet + start
+                progress(0.9 * done / len(rows), f"Writing raw rows {done:,} of {len(rows):,}...")
+                write_excel_rows(sheet, start + 1, df.take(sheet_rows[start:start + EXCEL_CHUNK_ROWS])[raw_cols],
+                                 datetime_format)
+        progress(0.9, "Compressing workbook...")
+
+def export_tables(df, rows):
+    # Raw rows as Arrow tables a chunk at a time; numeric and categorical columns convert without copying
+    raw_cols = [c for c in df.columns if c not in TIME_KEY_COLS]
+    for start in range(0, max(len(rows), 1), EXCEL_CHUNK_ROWS):
+        yield start, pa.Table.from_pandas(df.take(rows[start:start + EXCEL_CHUNK_ROWS])[raw_cols], preserve_index=False)
+
+def write_parquet_export(path, df, rows, progress=None):
+    progress = progress or (lambda done, text: None)
+    writer = None
+    for start, table in export_tables(df, rows):
+        progress(0.95 * start / max(len(rows), 1), f"Writing rows {start:,} of {len(rows):,}...")
+        writer = writer or pq.ParquetWriter(path, table.schema, compression='zstd')
+        writer.write_table(table)
+    writer.close()
+
+def write_csv_export(path, df, rows, codec, progress=None):
+    # Chunks are CSV-encoded and compressed on EXPORT_WORKERS threads (Arrow releases the GIL for both);
+    # consecutive gzip members / zstd frames concatenate into one valid file
+    progress = progress or (lambda done, text: None)
+    compressor = pa.Codec(codec)
+
+    def encode(item):
+        start, table = item
+        sink = pa.BufferOutputStream()
+        pa_csv.write_csv(table, sink, pa_csv.WriteOptions(include_header=start == 0))
+        return compressor.compress(sink.getvalue(), asbytes=True)
+
+    chunks = export_tables(df, rows)
+    with open(path, 'wb') as out, ThreadPoolExecutor(max_workers=EXPORT_WORKERS) as pool:
+        # At most EXPORT_WORKERS chunks are in flight, so memory stays bounded
+        while batch := [item for _, item in zip(range(EXPORT_WORKERS), chunks)]:
+            progress(0.95 * batch[0][0] / max(len(rows), 1), f"Compressing rows {batch[0][0]:,} of {len(rows):,}...")
+            for block in pool.map(encode, batch):
+                out.write(block)
+
+def write_bundle_export(path, df, rows, summary_df, settings, progress=None):
+    cycles = new_export_path('.parquet')
+    try:
+        write_parquet_export(cycles, df, rows, progress)
+        with zipfile.ZipFile(path, 'w') as bundle:
+            # Parquet is already compressed; the small text members are deflated
+            bundle.write(cycles, 'cycles.parquet', compress_type=zipfile.ZIP_STORED)
+            bundle.writestr('summary.csv', summary_df.to_csv(index=False), compress_type=zipfile.ZIP_DEFLATED)
+            bundle.writestr('filter_settings.json', json.dumps(settings, indent=2, default=str),
+                            compress_type=zipfile.ZIP_DEFLATED)
+    finally:
+        cycles.unlink(missing_ok=True)
+
+# Label -> (file suffix, writer(path, df, rows, summary_df, settings, progress))
+EXPORT_FORMATS = {
+    'Excel (.xlsx)': ('.xlsx', lambda path, df, rows, summary, settings, progress:
+                      write_excel_report(path, df, rows, summary, progress)),
+    'Parquet (.parquet)': ('.parquet', lambda path, df, rows, summary, settings, progress:
+                           write_parquet_export(path, df, rows, progress)),
+    'CSV (.csv.gz)': ('.csv.gz', lambda path, df, rows, summary, settings, progress:
+                      write_csv_export(path, df, rows, 'gzip', progress)),
+    'CSV (.csv.zst)': ('.csv.zst', lambda path, df, rows, summary, settings, progress:
+                       write_csv_export(path, df, rows, 'zstd', progress)),
+    'Zip bundle (.zip)': ('.zip', write_bundle_export),
+}
+
+def new_export_path(suffix):
+    EXPORT_DIR.mkdir(parents=True, exist_ok=True)
+    handle, path = tempfile.mkstemp(suffix=suffix, dir=EXPORT_DIR)
+    os.close(handle)
+    return Path(path)
+
+# --- WORKER ENTRY POINTS ---
+def run_export_job(label, input_path, rows, summary_df, settings, out_path, state):
+    def progress(done, text):
+        # The server's done callback treats this like a future cancelled before it started
+        if state['cancel']:
+            raise CancelledError()
+        state.update(done=done, text=text)
+
+    try:
+        with pa.memory_map(input_path) as source:
+            df = pa.ipc.open_file(source).read_all().to_pandas(split_blocks=True)
+        EXPORT_FORMATS[label][1](Path(out_path), df, rows, summary_df, settings, progress)
+    except BaseException:
+        Path(out_path).unlink(missing_ok=True)
+        raise
+    return out_path
+
+# Per worker process: stage results by key with their size, least recently used first
+ENGINE_MEMO_MB = float(os.environ.get('CYCLE_ENGINE_MEMO_MB', 512))
+ENGINE_MEMO = OrderedDict()
+
+@lru_cache(maxsize=4)
+def engine_frame(input_path):
+    with pa.memory_map(input_path) as source:
+        return pa.ipc.open_file(source).read_all().to_pandas(split_blocks=True)
+
+def engine_stage(name, fn, hashed):
+    # Worker-side stand-in for a stage cache, keyed on the arguments st.cache_resource hashes
+    def run(*args):
+        key = (name,) + tuple(args[i] for i in hashed)
+        if key not in ENGINE_MEMO:
+            value = fn(*args)
+            ENGINE_MEMO[key] = value, nbytes_of(value)
+            # Row-sized results vary by orders of magnitude, so the memo is bounded by bytes; the
+            # newest result stays even on its own over budget, as the rerun asking for it needs it
+            total = sum(nbytes for _, nbytes in ENGINE_MEMO.values())
+            while total > ENGINE_MEMO_MB * 1024 ** 2 and len(ENGINE_MEMO) > 1:
+                total -= ENGINE_MEMO.popitem(last=False)[1][1]
+        ENGINE_MEMO.move_to_end(key)
+        return ENGINE_MEMO[key][0]
+    return run
+
+ENGINE_STAGES = {
+    'window': engine_stage('window', window_rows, [1]),
+    'presort': engine_stage('presort', lambda df, rows, key: presort(df, rows), [2]),
+}
+
+def engine_aggregate(input_path, dataset_key, spec):
+    return aggregate(engine_frame(input_path), dataset_key, spec, ENGINE_STAGES)
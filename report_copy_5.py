@@ -1,75 +1,1103 @@
 import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 import pandas as pd
 import plotly.express as px
-import re
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
 import io
+import os
+import json
+import inspect
+import hashlib
+import hmac
+import tempfile
+import multiprocessing
 import gc 
-from datetime import datetime, time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, CancelledError
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache, partial
+from contextlib import contextmanager
+from pathlib import Path
+from datetime import datetime, time, timedelta
+from time import monotonic
+
+from cycle_engine import (TIME_KEY_COLS, TAIL_QUANTILES, EXPORT_DIR, EXPORT_FORMATS, extract_numeric_suffix,
+                          natural_station_order, parse_s_number, station_index, sv_tag_of, program_partitions,
+                          program_date_bounds, station_filter, band_rows, visible_rows, presort, read_only,
+                          window_rows, nbytes_of, aggregate, new_export_path, run_export_job, engine_aggregate)
 
 # --- CONFIG ---
 st.set_page_config(page_title="Cycle Time Analytics", layout="wide")
 
+# Only these columns are ever used; everything else in the MES export is skipped at read time
+REQUIRED_COLS = ['mainprogram_name1', 'stepprogram_name1', 'station_name1',
+                 'cycle_number1', 'step_start_utc1', 'total_cycle_time_secs1']
+CATEGORY_COLS = ['mainprogram_name1', 'stepprogram_name1', 'station_name1']
+UNIQUE_COLS = ['mainprogram_name1', 'station_name1', 'cycle_number1']
+# Raw timestamps are UTC; the plant reports in local time
+UTC_OFFSET = pd.Timedelta(hours=7)
+# Cache keys hash the footer plus a few sampled byte ranges instead of the whole upload
+FINGERPRINT_SAMPLES = 8
+FINGERPRINT_SAMPLE_BYTES = 64 * 1024
+# Default working-memory budget for streaming ingestion (decoded batches, on top of the compact result)
+INGEST_BUDGET_MB = 512
+# Files of a multi-file upload are decoded in parallel; pyarrow releases the GIL while decoding
+LOAD_WORKERS = int(os.environ.get('CYCLE_LOAD_WORKERS', min(8, os.cpu_count() or 1)))
+# Optional server-side history, hive-partitioned as <dir>/date=YYYY-MM-DD/mainprogram_name1=<name>/*.parquet
+# (either level may be omitted). Partition dates may be UTC or local days.
+DATA_DIR = os.environ.get('CYCLE_DATA_DIR')
+PARTITION_DATE_KEY = 'date'
+# Preprocessed datasets persist here as uncompressed Arrow IPC so a re-open is a memory map
+DISK_CACHE_DIR = Path(os.environ.get('CYCLE_CACHE_DIR', Path.home() / '.cache' / 'cycle_time_analyzer'))
+DISK_CACHE_BUDGET_GB = float(os.environ.get('CYCLE_CACHE_BUDGET_GB', 20))
+# Bump for preprocessing changes that the source hash below cannot see (e.g. a pandas upgrade)
+PREPROCESS_VERSION = 1
+
 # --- MEMORY-OPTIMIZED HELPER FUNCTIONS ---
-def extract_numeric_suffix(text):
-    s_match = re.search(r'_S(\d+)', str(text))
-    if s_match: return int(s_match.group(1))
-    match = re.search(r'(\d+)', str(text))
-    return int(match.group(1)) if match else 999
+def format_bytes(n):
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if abs(n) < 1024 or unit == 'GB': break
+        n /= 1024
+    return f"{n:,.1f} {unit}"
 
-def sort_by_station_number(station_list):
-    return sorted(station_list, key=extract_numeric_suffix)
+def file_fingerprint(file):
+    # Footer (schema, row-group metadata, statistics) + size + sampled ranges: O(footer), not O(file).
+    # Identical uploads from different sessions resolve to the same cached dataset.
+    file.seek(0, io.SEEK_END)
+    size = file.tell()
+    digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+    if size >= 12:
+        file.seek(size - 8)
+        footer_len = int.from_bytes(file.read(4), 'little')
+        file.seek(max(0, size - 8 - footer_len))
+        digest.update(file.read(footer_len + 8))
+    for i in range(FINGERPRINT_SAMPLES):
+        file.seek(size * i // FINGERPRINT_SAMPLES)
+        digest.update(file.read(FINGERPRINT_SAMPLE_BYTES))
+    file.seek(0)
+    return digest.hexdigest()
 
-@st.cache_data(show_spinner="Unpacking Parquet Data...")
-def load_data(file):
-    # Parquet is the most memory-efficient format for large industrial datasets
-    df = pd.read_parquet(file)
-    
+def dataset_fingerprint(files):
+    digest = hashlib.blake2b(digest_size=16)
+    for file in files:
+        digest.update(file_fingerprint(file).encode())
+    return digest.hexdigest()
+
+def open_parquet(file, **kwargs):
+    # Reads only the footer, so schema problems surface before any column is decoded
+    pf = pq.ParquetFile(file, **kwargs)
+    missing = [c for c in REQUIRED_COLS if c not in pf.schema_arrow.names]
+    if missing:
+        name = getattr(file, 'name', 'Parquet file')
+        raise ValueError(f"{name} is missing required column(s): {', '.join(missing)}")
+    return pf
+
+def uncompressed_bytes(meta, columns=None):
+    total = 0
+    for i in range(meta.num_row_groups):
+        rg = meta.row_group(i)
+        for j in range(rg.num_columns):
+            col = rg.column(j)
+            if columns is None or col.path_in_schema in columns:
+                total += col.total_uncompressed_size
+    return total
+
+def to_local_time(ts):
+    if not pd.api.types.is_datetime64_any_dtype(ts):
+        ts = pd.to_datetime(ts)
+    return ts - UTC_OFFSET
+
+def file_load_stats(metas, df, schema=None):
+    # Footers only describe the columns stored in the files; a dataset schema also carries the
+    # partition keys, which come from the directory names and cost nothing to read
+    stored = {name for m in metas for name in m.schema.names}
+    columns = schema.names if schema is not None else sorted(stored)
+    return {
+        'all_columns_bytes': sum(uncompressed_bytes(m) for m in metas),
+        'projected_bytes': sum(uncompressed_bytes(m, REQUIRED_COLS) for m in metas),
+        'num_columns': len(columns) if metas or schema is not None else 0,
+        'partition_columns': [c for c in columns if c not in stored],
+        'frame_bytes': int(df.memory_usage(deep=True).sum()),
+        'files': len(metas),
+    }
+
+def prepare_frame(df):
     # Enforce Unique Cycle IDs to ensure accurate QTY counts
-    unique_cols = ['mainprogram_name1', 'station_name1', 'cycle_number1']
-    df = df.drop_duplicates(subset=unique_cols, keep='last')
+    df = df.drop_duplicates(subset=UNIQUE_COLS, keep='last')
     
     # Memory Optimization: Categorical types reduce RAM usage significantly
-    for col in ['mainprogram_name1', 'stepprogram_name1', 'station_name1']:
-        if col in df.columns:
-            df[col] = df[col].astype('category')
+    for col in CATEGORY_COLS:
+        df[col] = df[col].astype('category')
     
-    if not pd.api.types.is_datetime64_any_dtype(df['step_start_utc1']):
-        df['step_start_utc1'] = pd.to_datetime(df['step_start_utc1'])
-    
-    df['step_start_utc1'] = df['step_start_utc1'] - pd.Timedelta(hours=7)
+    df['step_start_utc1'] = to_local_time(df['step_start_utc1'])
+    return finish_frame(df)
+
+def add_time_keys(df):
+    ts = df['step_start_utc1']
+    if ts.dt.tz is not None:
+        ts = ts.dt.tz_localize(None)  # local wall clock, as .dt.date/.dt.time see it
+    wall = ts.to_numpy()
+    days = wall.astype('datetime64[D]')
+    since_midnight = (wall - days).astype('timedelta64[ns]').astype(np.int64)
+    minute_ns = 60 * 10 ** 9
+    missing = np.isnat(wall)
+    # NaT rows get keys outside every range, matching how NaT drops out of the original comparisons
+    df['day_ordinal'] = np.where(missing, np.iinfo(np.int32).min, days.astype(np.int64)).astype(np.int32)
+    df['minute_tick'] = np.where(missing, -1, since_midnight // minute_ns * 2 + (since_midnight % minute_ns != 0)).astype(np.int16)
+    return df
+
+def finish_frame(df):
+    # Rows are grouped by program and ordered by local day/time, so a program is one contiguous
+    # block and a date range is a searchsorted slice inside it
+    df = add_time_keys(add_station_metadata(df))
+    order = np.lexsort((df['step_start_utc1'].array.asi8, df['day_ordinal'].to_numpy(),
+                        df['mainprogram_name1'].cat.codes.to_numpy()))
+    return df.take(order).reset_index(drop=True)
+
+def sv_tags_present(df):
+    stations = station_index(tuple(df['station_name1'].cat.categories))
+    return sorted({stations['sv_categories'][c] for c in stations['sv_code'][:-1]})
+
+# --- STAGED PIPELINE: each stage memoized on its own inputs ---
+# program -> SV -> date/hour -> noise band -> visibility -> aggregate -> chart / export.
+# Every stage key extends its parent's, so a widget change only misses the stages below it,
+# and going back to an earlier combination is a cache hit all the way down.
+STAGE_CACHE_ENTRIES = 64  # per dataset, within the dataset cache's byte budget
+# Workbooks are large, so each session keeps only its last few prepared reports
+REPORT_CACHE_ENTRIES = 4
+# Arrow spills that export jobs and engine workers read the frame from; kept apart from the store
+# with a budget of their own (oldest first), and expired once no rerun or job has used them for
+# EXPORT_TTL_HOURS. A spill an export is reading is never evicted
+EXPORT_INPUT_DIR = Path(tempfile.gettempdir()) / 'cycle_time_export_inputs'
+EXPORT_INPUT_BUDGET_GB = float(os.environ.get('CYCLE_EXPORT_INPUT_BUDGET_GB', 10))
+# Reports are written by background processes; finished files live in EXPORT_DIR until they expire
+# or the store outgrows its budget (oldest first)
+EXPORT_PROCESSES = int(os.environ.get('CYCLE_EXPORT_PROCESSES', 2))
+EXPORT_STORE_BUDGET_GB = float(os.environ.get('CYCLE_EXPORT_BUDGET_GB', 5))
+EXPORT_TTL_HOURS = float(os.environ.get('CYCLE_EXPORT_TTL_HOURS', 1))
+
+# Stage keys start with the dataset key; results are memoized in that dataset's cache entry
+def stage_window(df, key):
+    return dataset_stage(key[0], 'window', key, partial(window_rows, df, key))
+
+def stage_band(df, rows, key, noise_range):
+    return dataset_stage(key[0], 'band', (key, noise_range), lambda: read_only(band_rows(df, rows, noise_range)))
+
+def stage_visible(df, rows, key, ignored):
+    return dataset_stage(key[0], 'visible', (key, ignored),
+                         lambda: read_only(visible_rows(df, rows, station_filter(df, key[2], ignored))))
+
+def stage_presort(df, rows, key):
+    def run():
+        presorted = presort(df, rows)
+        read_only(*presorted.values())
+        return presorted
+    return dataset_stage(key[0], 'presort', key, run)
+
+@st.cache_data(max_entries=STAGE_CACHE_ENTRIES, show_spinner=False)
+def stage_chart(_summary, key, goal_time, bottleneck_buffered):
+    fig = px.bar(_summary, x='station_name1', y='median', color='sv_tag', text_auto='.1f', template="plotly_dark")
+    fig.add_hline(y=goal_time, line_color="green", annotation_text="Goal")
+    fig.add_hline(y=bottleneck_buffered, line_dash="dash", line_color="orange")
+    return fig
+
+# The stages one rerun runs through, by name; engine workers swap in their own memo (ENGINE_STAGES)
+SERVER_STAGES = {'window': stage_window, 'presort': stage_presort}
+
+def add_station_metadata(df):
+    # Natural station order lets every later sort/groupby run on category codes
+    df['station_name1'] = df['station_name1'].cat.reorder_categories(
+        natural_station_order(df['station_name1'].cat.categories), ordered=True)
     
     # Extract SV Tag
-    df['sv_tag'] = df['station_name1'].astype(str).apply(
-        lambda x: re.search(r'SV\d+', x).group(0) if re.search(r'SV\d+', x) else "Other"
-    ).astype('category')
-    
+    stations = station_index(tuple(df['station_name1'].cat.categories))
+    df['sv_tag'] = pd.Categorical.from_codes(
+        stations['sv_code'][df['station_name1'].cat.codes.to_numpy()], stations['sv_categories'])
     return df
 
-def convert_df_to_excel(df_final, summary_df):
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        summary_df.to_excel(writer, index=False, sheet_name='Summary_Stats')
-        df_final.iloc[:1000000].to_excel(writer, index=False, sheet_name='Cleaned_Raw_Data')
-    return output.getvalue()
+# --- STREAMING INGESTION: one batch decoded at a time, compact codes kept ---
+def encode_chunk(values, lookup):
+    # Encode against the running category list; only the chunk's dictionary is touched in Python
+    if not pa.types.is_dictionary(values.type):
+        values = pc.dictionary_encode(values)
+    remap = np.array([lookup.setdefault(v, len(lookup)) for v in values.dictionary.to_pylist()] + [-1], dtype=np.int32)
+    return remap[values.indices.fill_null(-1).to_numpy(zero_copy_only=False)]
+
+def finish_categorical(codes, lookup):
+    # Codes were assigned in first-seen order; remap once so categories come out sorted like astype('category')
+    names = list(lookup)
+    order = sorted(range(len(names)), key=lambda i: str(names[i]))
+    new_code = np.empty(len(names) + 1, dtype=np.int32)
+    new_code[order] = np.arange(len(names), dtype=np.int32)
+    new_code[-1] = -1
+    return pd.Categorical.from_codes(new_code[codes], [names[i] for i in order]).remove_unused_categories()
+
+def decode_file(pf, budget_bytes):
+    bytes_per_row = max(1.0, uncompressed_bytes(pf.metadata, REQUIRED_COLS) / max(1, pf.metadata.num_rows))
+    # A decoded batch exists as Arrow buffers, encoded codes and pandas temporaries at once
+    batch_rows = max(10_000, int(budget_bytes / (bytes_per_row * 4)))
+    lookups = {c: {} for c in CATEGORY_COLS}
+    kept, pending, pending_rows, batches = None, [], 0, 0
+
+    def compact(frames):
+        # Rows stay in file order, so keep='last' here matches a single drop_duplicates over the whole file
+        merged = pd.concat(frames, ignore_index=True)
+        return merged[~merged.duplicated(subset=UNIQUE_COLS, keep='last')].reset_index(drop=True)
+
+    for batch in pf.iter_batches(batch_size=batch_rows, columns=REQUIRED_COLS):
+        chunk = pd.DataFrame({c: encode_chunk(batch.column(c), lookups[c]) for c in CATEGORY_COLS})
+        chunk['cycle_number1'] = batch.column('cycle_number1').to_numpy(zero_copy_only=False)
+        chunk['step_start_utc1'] = to_local_time(batch.column('step_start_utc1').to_pandas())
+        chunk['total_cycle_time_secs1'] = batch.column('total_cycle_time_secs1').to_numpy(zero_copy_only=False)
+        pending.append(chunk)
+        pending_rows += len(chunk)
+        batches += 1
+        # Compact once the undeduped tail outgrows the deduped head, keeping total dedupe work O(n log n)
+        if pending_rows >= max(batch_rows, 0 if kept is None else len(kept)):
+            kept = compact(([] if kept is None else [kept]) + pending)
+            pending, pending_rows = [], 0
+
+    frames = ([] if kept is None else [kept]) + pending
+    if not frames:
+        df = pf.schema_arrow.empty_table().select(REQUIRED_COLS).to_pandas().astype({c: 'category' for c in CATEGORY_COLS})
+        df['step_start_utc1'] = to_local_time(df['step_start_utc1'])
+        return df, batch_rows, batches
+    df = compact(frames)
+    for col in CATEGORY_COLS:
+        df[col] = finish_categorical(df[col].to_numpy(), lookups[col])
+    return df, batch_rows, batches
+
+def unify_categories(frames):
+    # Dictionaries are merged at the category level and row codes remapped with one take,
+    # so no string is ever re-encoded
+    for col in CATEGORY_COLS:
+        merged = pd.Index(sorted(set().union(*(f[col].cat.categories for f in frames)), key=str))
+        for f in frames:
+            recode = np.append(merged.get_indexer(f[col].cat.categories), -1).astype(np.int32)
+            f[col] = pd.Categorical.from_codes(recode[f[col].cat.codes.to_numpy()], merged)
+    return frames
+
+def merge_files(frames):
+    # Frames arrive in file-name order, so keep='last' lets the later file win
+    df = frames[0]
+    if len(frames) > 1:
+        df = pd.concat(unify_categories(frames), ignore_index=True)
+        df = df[~df.duplicated(subset=UNIQUE_COLS, keep='last')].reset_index(drop=True)
+    return finish_frame(df)
+
+# --- PERSISTENT DISK CACHE ---
+@lru_cache(maxsize=1)
+def preprocess_key():
+    # Any edit to the preprocessing code changes this key, which orphans every older cache file
+    funcs = [parse_s_number, extract_numeric_suffix, sv_tag_of, natural_station_order, station_index,
+             to_local_time, prepare_frame, finish_frame, add_station_metadata, add_time_keys, encode_chunk, finish_categorical, decode_file,
+             unify_categories, merge_files]
+    source = ''.join(inspect.getsource(f) for f in funcs)
+    source += repr((PREPROCESS_VERSION, REQUIRED_COLS, CATEGORY_COLS, UNIQUE_COLS, TIME_KEY_COLS, UTC_OFFSET, pd.__version__))
+    return hashlib.blake2b(source.encode(), digest_size=8).hexdigest()
+
+def disk_cache_path(fingerprint):
+    return DISK_CACHE_DIR / f"{fingerprint}-{preprocess_key()}.arrow"
+
+def read_disk_cache(fingerprint):
+    path = disk_cache_path(fingerprint)
+    if not path.exists():
+        return None
+    try:
+        with pa.memory_map(str(path)) as source:
+            table = pa.ipc.open_file(source).read_all()
+    except (OSError, pa.ArrowInvalid):
+        path.unlink(missing_ok=True)
+        return None
+    path.touch()  # mtime doubles as the LRU clock
+    load_stats = json.loads(table.schema.metadata[b'load_stats'])
+    load_stats['disk_cache'] = 'hit'
+    return table.to_pandas(split_blocks=True), load_stats
+
+def write_disk_cache(fingerprint, df, load_stats):
+    DISK_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata({**table.schema.metadata, b'load_stats': json.dumps(load_stats).encode()})
+    path = disk_cache_path(fingerprint)
+    tmp = path.with_suffix(f'.tmp{os.getpid()}')
+    # Uncompressed so reads can be served straight from the memory map
+    feather.write_feather(table, str(tmp), compression='uncompressed')
+    os.replace(tmp, path)
+    evict_disk_cache()
+
+def evict_disk_cache():
+    key = preprocess_key()
+    entries = []
+    in_use = export_paths_in_use()  # a queued export may still read a cached frame
+    for path in DISK_CACHE_DIR.glob('*.arrow'):
+        if path in in_use:
+            continue
+        if not path.stem.endswith(f'-{key}'):
+            path.unlink(missing_ok=True)  # written by older preprocessing logic
+        else:
+            stat = path.stat()
+            entries.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= DISK_CACHE_BUDGET_GB * 1024 ** 3:
+            break
+        path.unlink(missing_ok=True)
+        total -= size
+
+def load_data(files, fingerprint, budget_mb=INGEST_BUDGET_MB):
+    cached = read_disk_cache(fingerprint)
+    if cached is not None:
+        return cached
+    # Parquet is the most memory-efficient format for large industrial datasets
+    pfs = [open_parquet(f) for f in files]
+    workers = max(1, min(len(pfs), LOAD_WORKERS))
+    budget_bytes = budget_mb * 1024 ** 2 / workers
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        decoded = list(pool.map(lambda pf: decode_file(pf, budget_bytes), pfs))
+    df = merge_files([frame for frame, _, _ in decoded])
+    load_stats = file_load_stats([pf.metadata for pf in pfs], df)
+    load_stats['batches'] = (sum(n for _, _, n in decoded), max(rows for _, rows, _ in decoded), budget_mb)
+    try:
+        write_disk_cache(fingerprint, df, load_stats)
+    except OSError as e:
+        st.warning(f"Could not write the disk cache: {e}")
+        return df, load_stats
+    # Serve even a fresh load from the memory map: read-only, file-backed Arrow buffers the OS can
+    # page out, instead of heap the process holds
+    cached = read_disk_cache(fingerprint)
+    return (cached[0], load_stats) if cached is not None else (df, load_stats)
+
+# --- SCAN MODE: program/date filters pushed into the Parquet read ---
+# Scans read this many extra days either side of the range, so the dedupe sees a cycle's re-logs
+# just outside it and keeps the same record a full load would
+SCAN_DEDUPE_PAD_DAYS = int(os.environ.get('CYCLE_SCAN_DEDUPE_PAD_DAYS', 2))
+
+def open_dataset(source, dictionary_columns=()):
+    # source is either a list of uploaded files or a server-side directory
+    fmt = ds.ParquetFileFormat(read_options=ds.ParquetReadOptions(dictionary_columns=set(dictionary_columns)))
+    if isinstance(source, (str, Path)):
+        dataset = ds.dataset(source, format=fmt, partitioning='hive')
+        if not dataset.files:
+            raise ValueError(f"No Parquet files found in {source}")
+        missing = [c for c in REQUIRED_COLS if c not in dataset.schema.names]
+        if missing:
+            raise ValueError(f"{source} is missing required column(s): {', '.join(missing)}")
+        return dataset
+    fragments = []
+    for f in source:
+        open_parquet(f)
+        f.seek(0)
+        fragments.append(fmt.make_fragment(f))
+    # Later files are cast to the first file's types for the columns we read
+    schema = pa.schema([fragments[0].physical_schema.field(c) for c in REQUIRED_COLS])
+    return ds.FileSystemDataset(fragments, schema=schema, format=fmt)
+
+def directory_fingerprint(path):
+    # Listing metadata only; a new or rewritten partition file changes the key
+    digest = hashlib.blake2b(str(path).encode(), digest_size=16)
+    for root, dirs, names in os.walk(path):
+        dirs[:] = sorted(d for d in dirs if not d.startswith(('.', '_')))
+        for name in sorted(n for n in names if not n.startswith(('.', '_'))):
+            stat = os.stat(os.path.join(root, name))
+            digest.update(f"{os.path.relpath(os.path.join(root, name), path)}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return digest.hexdigest()
+
+def timestamp_bounds(fragment, schema):
+    # Row-group statistics give min/max without decoding the column
+    if pa.types.is_timestamp(schema.field('step_start_utc1').type):
+        fragment.ensure_complete_metadata()
+        stats = [(rg.statistics or {}).get('step_start_utc1') for rg in fragment.row_groups]
+        if stats and all(s is not None for s in stats):
+            return pd.Timestamp(min(s['min'] for s in stats)), pd.Timestamp(max(s['max'] for s in stats))
+    ts = pd.to_datetime(fragment.to_table(columns=['step_start_utc1'], schema=schema).column(0).to_pandas())
+    return ts.min(), ts.max()
+
+def distinct_values(array):
+    # A dictionary-encoded batch already carries its distinct values
+    values = array.dictionary if pa.types.is_dictionary(array.type) else pc.unique(array)
+    return [v for v in values.to_pylist() if v is not None]
+
+@st.cache_data(show_spinner=False)
+def fragment_catalog(_fragment, _schema, file_key):
+    # One file's share of the catalog. file_key names the file's contents, so a directory that gains
+    # a file only decodes the new one and the rest of the history is answered from here
+    programs, stations = set(), set()
+    for batch in _fragment.to_batches(columns=['mainprogram_name1', 'station_name1'], schema=_schema):
+        programs.update(distinct_values(batch.column('mainprogram_name1')))
+        stations.update(distinct_values(batch.column('station_name1')))
+    return programs, stations, timestamp_bounds(_fragment, _schema)
+
+def fragment_keys(source, dataset):
+    if isinstance(source, (str, Path)):
+        for frag in dataset.get_fragments():
+            stat = os.stat(frag.path)
+            yield frag, (frag.path, stat.st_size, stat.st_mtime_ns)
+    else:
+        yield from ((frag, file_fingerprint(f)) for frag, f in zip(dataset.get_fragments(), source))
+
+@st.cache_data(show_spinner="Reading Parquet Catalog...")
+def load_catalog(_source, fingerprint):
+    # Just enough to populate the sidebar: two dictionary-encoded columns plus footer statistics, per file
+    dataset = open_dataset(_source, dictionary_columns=['mainprogram_name1', 'station_name1'])
+    programs, stations, lows, highs = set(), set(), [], []
+    for frag, file_key in fragment_keys(_source, dataset):
+        file_programs, file_stations, (lo, hi) = fragment_catalog(frag, dataset.schema, file_key)
+        programs |= file_programs
+        stations |= file_stations
+        if pd.notna(lo):  # a file without timestamps has no bounds
+            lows.append(lo)
+            highs.append(hi)
+    lo, hi = (min(lows), max(highs)) if lows else (pd.NaT, pd.NaT)
+    return {
+        'programs': sorted(programs),
+        'sv_tags': sorted({sv_tag_of(s) for s in stations}),
+        'min_date': (lo - UTC_OFFSET).date(),
+        'max_date': (hi - UTC_OFFSET).date(),
+    }
+
+def scan_filter(schema, program, start_date, end_date):
+    expr = ds.field('mainprogram_name1') == program
+    ts_type = schema.field('step_start_utc1').type
+    # Only a real timestamp column has usable statistics; string timestamps are filtered after load
+    if pa.types.is_timestamp(ts_type):
+        lo, hi = pd.Timestamp(start_date), pd.Timestamp(end_date) + pd.Timedelta(days=1)
+        if ts_type.tz:
+            lo, hi = lo.tz_localize(ts_type.tz), hi.tz_localize(ts_type.tz)
+        lo, hi = lo + UTC_OFFSET, hi + UTC_OFFSET
+        expr &= (ds.field('step_start_utc1') >= pa.scalar(lo, type=ts_type)) & \
+                (ds.field('step_start_utc1') < pa.scalar(hi, type=ts_type))
+    # A local day spans two UTC days, so the partition range reaches one day past the end date
+    if PARTITION_DATE_KEY in schema.names:
+        part_type = schema.field(PARTITION_DATE_KEY).type
+        lo, hi = start_date, end_date + timedelta(days=1)
+        if pa.types.is_string(part_type) or pa.types.is_large_string(part_type):
+            lo, hi = lo.isoformat(), hi.isoformat()
+        if pa.types.is_date(part_type) or pa.types.is_string(part_type) or pa.types.is_large_string(part_type):
+            expr &= (ds.field(PARTITION_DATE_KEY) >= pa.scalar(lo, type=part_type)) & \
+                    (ds.field(PARTITION_DATE_KEY) <= pa.scalar(hi, type=part_type))
+    return expr
+
+def padded_range(start_date, end_date):
+    pad = timedelta(days=SCAN_DEDUPE_PAD_DAYS)
+    return start_date - pad, end_date + pad
+
+def load_data_scan(source, program, start_date, end_date):
+    # Dedupe runs on the padded range and the pad is trimmed after, so a cycle re-logged across the
+    # date boundary loses its in-range record exactly as in a full load. Only re-logs further apart
+    # than the pad can still differ: the scan then keeps the in-range record
+    dataset = open_dataset(source)
+    expr = scan_filter(dataset.schema, program, *padded_range(start_date, end_date))
+    # Partition pruning happens here, before any file in a non-matching partition is opened
+    fragments = list(dataset.get_fragments(filter=expr))
+    matched = sum(len(frag.split_by_row_group(expr, schema=dataset.schema)) for frag in fragments)
+    df = prepare_frame(dataset.to_table(columns=REQUIRED_COLS, filter=expr).to_pandas())
+    lo, hi = program_date_bounds(df, program_partitions(df), program, start_date, end_date)
+    df = df.iloc[lo:hi].reset_index(drop=True).copy()
+    load_stats = file_load_stats([frag.metadata for frag in fragments], df, dataset.schema)
+    load_stats['row_groups'] = (matched, sum(frag.num_row_groups for frag in fragments))
+    load_stats['files'] = (len(fragments), len(dataset.files))
+    return df, load_stats
+
+# --- HEAVY JOBS: loads and exports share one server-wide queue ---
+# At most this many CPU threads and this much estimated working memory are committed to heavy jobs
+# at once; the rest wait in line. A job bigger than the memory cap still runs, alone.
+HEAVY_CPU_SLOTS = int(os.environ.get('CYCLE_HEAVY_CPU_SLOTS', os.cpu_count() or 1))
+HEAVY_MEMORY_GB = float(os.environ.get('CYCLE_HEAVY_MEMORY_GB', 4))
+
+@st.cache_resource
+def heavy_jobs():
+    # queue/running: tickets in arrival order; flights: key -> the one computation identical requests share
+    return {'lock': threading.RLock(), 'queue': [], 'running': [], 'flights': {}}
+
+def heavy_ticket(label, cpu, nbytes, start):
+    return {'label': label, 'cpu': max(1, min(cpu, HEAVY_CPU_SLOTS)), 'bytes': nbytes, 'start': start}
+
+def dispatch_heavy(jobs):
+    # Under the lock. First come, first served: a small job never overtakes a big one waiting for room
+    while jobs['queue']:
+        ticket = jobs['queue'][0]
+        cpu = sum(t['cpu'] for t in jobs['running']) + ticket['cpu']
+        nbytes = sum(t['bytes'] for t in jobs['running']) + ticket['bytes']
+        if jobs['running'] and (cpu > HEAVY_CPU_SLOTS or nbytes > HEAVY_MEMORY_GB * 1024 ** 3):
+            break
+        jobs['running'].append(jobs['queue'].pop(0))
+        ticket['start']()
+
+def enqueue_heavy(ticket):
+    jobs = heavy_jobs()
+    with jobs['lock']:
+        jobs['queue'].append(ticket)
+        dispatch_heavy(jobs)
+
+def finish_heavy(ticket):
+    # Releases a running ticket or withdraws a queued one
+    jobs = heavy_jobs()
+    with jobs['lock']:
+        jobs['running'] = [t for t in jobs['running'] if t is not ticket]
+        jobs['queue'] = [t for t in jobs['queue'] if t is not ticket]
+        dispatch_heavy(jobs)
+
+def heavy_position(ticket):
+    # 1-based place in line; 0 once the ticket is running (or gone)
+    jobs = heavy_jobs()
+    with jobs['lock']:
+        return next((i + 1 for i, t in enumerate(jobs['queue']) if t is ticket), 0)
+
+@contextmanager
+def heavy_slot(label, cpu, nbytes, on_wait=None):
+    started = threading.Event()
+    ticket = heavy_ticket(label, cpu, nbytes, started.set)
+    enqueue_heavy(ticket)
+    try:
+        while not started.wait(1.0):
+            if on_wait is not None:
+                on_wait(f"Queued: {label} is number {heavy_position(ticket)} in line for the server.")
+        yield
+    finally:
+        finish_heavy(ticket)
+
+def single_flight(key, compute, on_wait=None, label="this job"):
+    # Identical requests that arrive while one is in flight wait for its result instead of repeating it
+    jobs = heavy_jobs()
+    while True:
+        with jobs['lock']:
+            flight = jobs['flights'].get(key)
+            owner = flight is None
+            if owner:
+                flight = jobs['flights'][key] = {'done': threading.Event()}
+        if owner:
+            try:
+                flight['result'] = compute()
+            except BaseException as e:
+                flight['error'] = e
+                raise
+            finally:
+                with jobs['lock']:
+                    del jobs['flights'][key]
+                flight['done'].set()
+            return flight['result']
+        while not flight['done'].wait(1.0):
+            if on_wait is not None:
+                on_wait(f"Waiting for {label}, already started by another session.")
+        error = flight.get('error')
+        if error is None:
+            return flight['result']
+        if isinstance(error, Exception):
+            raise error
+        # The owner's script run was stopped, not failed: take the job over
+
+# --- DATASET CACHE: one server-wide LRU of loaded frames under a RAM budget ---
+# Datasets are held once per server and handed to every session as the same object; st.cache_data
+# would unpickle a full copy on every rerun of every session. pandas >= 3 is copy-on-write, so a
+# session can never change the shared frame in place.
+DATASET_BUDGET_GB = float(os.environ.get('CYCLE_DATASET_BUDGET_GB', 8))
+# Each session holds the dataset it is looking at until it moves to another source; a new load waits
+# for held datasets to be released (up to the queue timeout) rather than evicting them. A closed tab
+# never releases its dataset, so a hold also lapses once its session has not rerun for this long
+DATASET_IDLE_SECONDS = float(os.environ.get('CYCLE_DATASET_IDLE_SECONDS', 600))
+DATASET_QUEUE_SECONDS = float(os.environ.get('CYCLE_DATASET_QUEUE_SECONDS', 60))
+# The admin panels list every session's datasets and jobs; they are off unless this token is set
+ADMIN_TOKEN = os.environ.get('CYCLE_ADMIN_TOKEN')
+
+@st.cache_resource
+def dataset_cache():
+    # entries: key -> entry, least recently used first; held: session -> the key it holds;
+    # reserved: estimates of the loads in flight
+    return {'entries': OrderedDict(), 'held': {}, 'reserved': 0, 'lock': threading.Condition(),
+            'budget': int(DATASET_BUDGET_GB * 1024 ** 3)}
+
+def dataset_cache_used(cache):
+    return sum(entry['bytes'] + entry['stage_bytes'] for entry in cache['entries'].values()) + cache['reserved']
+
+def session_id():
+    # None outside a script run (benchmarks, worker threads), which then share one holder
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx is not None else None
+
+def is_held(entry, now):
+    return any(now - seen < DATASET_IDLE_SECONDS for seen in entry['holders'].values())
+
+def hold_dataset(cache, key):
+    # Called with the lock held. The session's hold moves to key (None: it holds nothing), so the
+    # dataset it looked at before is free to evict as soon as it moves on
+    holder = session_id()
+    previous = cache['held'].get(holder)
+    if previous is not None and previous != key:
+        entry = cache['entries'].get(previous)
+        if entry is not None:
+            entry['holders'].pop(holder, None)
+        cache['lock'].notify_all()
+    if key is None:
+        cache['held'].pop(holder, None)
+        return
+    cache['held'][holder] = key
+    entry = cache['entries'].get(key)
+    if entry is not None:
+        entry['holders'][holder] = monotonic()
+
+def release_dataset():
+    cache = dataset_cache()
+    with cache['lock']:
+        hold_dataset(cache, None)
+
+def evict_datasets(cache, needed):
+    # Entries no session holds go oldest first until `needed` more bytes fit; returns whether they do
+    now = monotonic()
+    for key, entry in list(cache['entries'].items()):
+        if dataset_cache_used(cache) + needed <= cache['budget']:
+            break
+        if not is_held(entry, now):
+            del cache['entries'][key]
+            for holder in [h for h, held in cache['held'].items() if held == key]:
+                del cache['held'][holder]
+    return dataset_cache_used(cache) + needed <= cache['budget']
+
+def cached_dataset(key, label, cost, load, on_wait=None):
+    cache = dataset_cache()
+    with cache['lock']:
+        hold_dataset(cache, key)
+        entry = cache['entries'].get(key)
+        if entry is not None:
+            cache['entries'].move_to_end(key)
+            entry['used'] = monotonic()
+            entry['hits'] += 1
+            return entry['value']
+    value = single_flight(('dataset', key), partial(admit_dataset, cache, key, label, cost, load, on_wait),
+                          on_wait, f"the load of {label}")
+    with cache['lock']:
+        hold_dataset(cache, key)  # sessions that waited on another's load hold it too
+    return value
+
+def admit_dataset(cache, key, label, cost, load, on_wait=None):
+    # cost() bounds the load up front from Parquet footers (or the disk-cache file) as
+    # (bytes, threads); the entry is then charged its actual in-memory size
+    estimate, cpu = cost()
+    with cache['lock']:
+        entry = cache['entries'].get(key)
+        if entry is not None:
+            return entry['value']  # a flight for the same key finished just before this one began
+        if estimate > cache['budget']:
+            raise ValueError(f"{label} needs about {format_bytes(estimate)} in memory, more than the "
+                             f"server's {format_bytes(cache['budget'])} dataset budget. Narrow the upload or use Scan Mode.")
+        deadline = monotonic() + DATASET_QUEUE_SECONDS
+        while not evict_datasets(cache, estimate):
+            if monotonic() >= deadline:
+                raise ValueError(f"The server is busy: {format_bytes(dataset_cache_used(cache))} of "
+                                 f"{format_bytes(cache['budget'])} is held by datasets in use. Try again shortly.")
+            if on_wait is not None:
+                on_wait(f"Queued: {label} needs about {format_bytes(estimate)}; "
+                        f"{format_bytes(dataset_cache_used(cache))} of {format_bytes(cache['budget'])} is in use.")
+            cache['lock'].wait(1.0)
+        cache['reserved'] += estimate
+    try:
+        with heavy_slot(f"loading {label}", cpu, estimate, on_wait):
+            value = load()
+    finally:
+        with cache['lock']:
+            cache['reserved'] -= estimate
+            cache['lock'].notify_all()
+    with cache['lock']:
+        now = monotonic()
+        cache['entries'][key] = {'value': value, 'label': label, 'bytes': value[1]['frame_bytes'],
+                                 'stages': OrderedDict(), 'stage_bytes': 0, 'hits': 0, 'loaded': now, 'used': now,
+                                 'holders': {session_id(): now}}
+        # An estimate that came in low is settled here, against datasets nobody holds
+        evict_datasets(cache, 0)
+    return value
+
+def drop_stage(entry):
+    # Oldest first
+    _, (_, nbytes) = entry['stages'].popitem(last=False)
+    entry['stage_bytes'] -= nbytes
+
+def dataset_stage(dataset_key, name, stage_key, compute):
+    # Row-sized intermediate results (row indices, presorted values) belong to one dataset: they are
+    # charged to its entry against the budget and go when it is evicted. Without an entry (not a
+    # cached dataset, or evicted meanwhile) the result is computed but not kept.
+    cache, key = dataset_cache(), (name, stage_key)
+    with cache['lock']:
+        entry = cache['entries'].get(dataset_key)
+        if entry is not None and key in entry['stages']:
+            entry['stages'].move_to_end(key)
+            return entry['stages'][key][0]
+    value = single_flight(('stage', dataset_key, key), compute)
+    with cache['lock']:
+        entry = cache['entries'].get(dataset_key)
+        if entry is None or key in entry['stages']:
+            return value
+        nbytes = nbytes_of(value)
+        entry['stages'][key] = value, nbytes
+        entry['stage_bytes'] += nbytes
+        while len(entry['stages']) > STAGE_CACHE_ENTRIES:
+            drop_stage(entry)
+        # Over budget: datasets nobody holds go first, then this dataset's older stages
+        if not evict_datasets(cache, 0):
+            while len(entry['stages']) > 1 and dataset_cache_used(cache) > cache['budget']:
+                drop_stage(entry)
+    return value
+
+def load_with_spinner(text, load, *args):
+    with st.spinner(text):
+        return load(*args)
+
+def upload_cost(files, fingerprint):
+    # A disk-cache hit maps the cached file; a fresh load is bounded by the projected Parquet bytes
+    # and decodes up to LOAD_WORKERS files at once
+    path = disk_cache_path(fingerprint)
+    if path.exists():
+        return path.stat().st_size, 1
+    return sum(uncompressed_bytes(open_parquet(f).metadata, REQUIRED_COLS) for f in files), min(len(files), LOAD_WORKERS)
+
+def scan_cost(source, program, start_date, end_date):
+    dataset = open_dataset(source)
+    expr = scan_filter(dataset.schema, program, *padded_range(start_date, end_date))
+    return sum(uncompressed_bytes(frag.metadata, REQUIRED_COLS) for frag in dataset.get_fragments(filter=expr)), LOAD_WORKERS
+
+def is_admin():
+    # ?admin=<CYCLE_ADMIN_TOKEN> in the URL
+    token = st.query_params.get('admin')
+    return bool(ADMIN_TOKEN and token) and hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+def dataset_cache_panel():
+    # Admin view, see is_admin()
+    cache = dataset_cache()
+    with cache['lock']:
+        now, used, budget = monotonic(), dataset_cache_used(cache), cache['budget']
+        rows = [{'Dataset': e['label'], 'Frame': format_bytes(e['bytes']),
+                 'Stages': f"{len(e['stages'])} · {format_bytes(e['stage_bytes'])}", 'Hits': e['hits'],
+                 'Idle (s)': int(now - e['used']),
+                 'Sessions': sum(now - seen < DATASET_IDLE_SECONDS for seen in e['holders'].values()),
+                 'State': 'in use' if is_held(e, now) else 'idle'}
+                for e in reversed(cache['entries'].values())]
+        reserved = cache['reserved']
+    with st.sidebar.expander("Dataset Cache (admin)", expanded=True):
+        st.progress(min(1.0, used / budget), text=f"{format_bytes(used)} of {format_bytes(budget)}")
+        if reserved:
+            st.caption(f"{format_bytes(reserved)} reserved by loads in progress")
+        if rows:
+            st.dataframe(pd.DataFrame(rows), hide_index=True, width='stretch')
+        else:
+            st.caption("No datasets loaded.")
+
+def heavy_jobs_panel():
+    # Admin view, next to the dataset cache
+    jobs = heavy_jobs()
+    with jobs['lock']:
+        rows = [{'Job': t['label'], 'State': state, 'Threads': t['cpu'], 'Memory': format_bytes(t['bytes'])}
+                for state, tickets in [('running', jobs['running']), ('queued', jobs['queue'])] for t in tickets]
+    with st.sidebar.expander("Heavy Jobs (admin)", expanded=True):
+        st.caption(f"Up to {HEAVY_CPU_SLOTS} threads and {HEAVY_MEMORY_GB:g} GB at once")
+        if rows:
+            st.dataframe(pd.DataFrame(rows), hide_index=True, width='stretch')
+        else:
+            st.caption("Idle.")
+
+def show_load_stats(load_stats):
+    files = load_stats['files']
+    files = "{} of {}".format(*files) if isinstance(files, (tuple, list)) else files
+    text = (f"Loaded {len(REQUIRED_COLS)} of {load_stats['num_columns']} columns "
+            f"from {files} file(s)")
+    if load_stats.get('partition_columns'):
+        text += f", partition columns {', '.join(load_stats['partition_columns'])} from directory names"
+    text += (f" · stored columns {format_bytes(load_stats['all_columns_bytes'])} → "
+             f"projected {format_bytes(load_stats['projected_bytes'])} (uncompressed) · "
+             f"in memory {format_bytes(load_stats['frame_bytes'])}")
+    if load_stats.get('disk_cache') == 'hit':
+        text += " · opened from disk cache"
+    elif 'batches' in load_stats:
+        text += " · streamed {} batches of ≤{:,} rows ({} MB budget)".format(*load_stats['batches'])
+    if 'row_groups' in load_stats:
+        text += " · scanned {} of {} row groups".format(*load_stats['row_groups'])
+    st.caption(text)
+
+# --- BACKGROUND EXPORT JOBS ---
+def worker_context():
+    # Worker processes never fork from this server, whose heap (every cached dataset) they would keep
+    # for the life of the pool. They fork from a fork server that has only imported cycle_engine, or
+    # are spawned where there is none (Windows). multiprocessing still re-runs this script's module
+    # level (imports and definitions; main() is guarded) once in each new worker
+    if 'forkserver' not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('spawn')
+    context = multiprocessing.get_context('forkserver')
+    context.set_forkserver_preload(['cycle_engine'])
+    return context
+
+@st.cache_resource
+def export_pool():
+    # Shared by every session
+    context = worker_context()
+    return ProcessPoolExecutor(max_workers=EXPORT_PROCESSES, mp_context=context), context.Manager()
+
+def job_input_path(df, dataset_key):
+    # Workers memory-map the frame from Arrow IPC instead of receiving it pickled. An upload's
+    # disk cache file already is one; anything else (scan mode, no disk cache) is spilled once
+    path = disk_cache_path(dataset_key[1]) if dataset_key[0] == 'upload' else None
+    if path is None or not path.exists():
+        EXPORT_INPUT_DIR.mkdir(parents=True, exist_ok=True)
+        path = EXPORT_INPUT_DIR / f"input-{hashlib.blake2b(repr(dataset_key).encode(), digest_size=8).hexdigest()}.arrow"
+        if not path.exists():
+            tmp = path.with_suffix(f'.tmp{os.getpid()}')
+            feather.write_feather(df, str(tmp), compression='uncompressed')
+            os.replace(tmp, path)
+            evict_export_store(keep={path})
+    path.touch()
+    return path
+
+def submit_export(label, df, dataset_key, rows, summary_df, settings, key):
+    # key covers the dataset, every filter and the format, so sessions asking for the same report
+    # at the same time share one job
+    evict_export_store()
+    jobs = heavy_jobs()
+    with jobs['lock']:
+        flight = jobs['flights'].get(('export', key))
+        if flight is not None:
+            flight['subscribers'] += 1
+            return {'key': key, 'flight': flight}
+    pool, manager = export_pool()
+    suffix = EXPORT_FORMATS[label][0]
+    state = manager.dict(done=0.0, text="Starting...", cancel=False)
+    path = new_export_path(suffix)
+    input_path = job_input_path(df, dataset_key)
+    args = (label, str(input_path), rows, summary_df, settings, str(path), state)
+    # Working memory scales with the selected rows' share of the frame
+    nbytes = int(df.memory_usage(deep=True).sum() / max(len(df), 1) * len(rows))
+    flight = {'state': state, 'path': path, 'input': input_path, 'suffix': suffix, 'future': None, 'subscribers': 1}
+    flight['ticket'] = heavy_ticket(f"the {label} export", 1, nbytes, partial(start_export, flight, key, args))
+    with jobs['lock']:
+        shared = jobs['flights'].setdefault(('export', key), flight)
+        if shared is not flight:
+            # Another session submitted the same report meanwhile
+            shared['subscribers'] += 1
+            path.unlink(missing_ok=True)
+            return {'key': key, 'flight': shared}
+    enqueue_heavy(flight['ticket'])
+    return {'key': key, 'flight': flight}
+
+def start_export(flight, key, args):
+    flight['future'] = export_pool()[0].submit(run_export_job, *args)
+    flight['future'].add_done_callback(partial(end_export, flight, key))
+
+def end_export(flight, key, future):
+    jobs = heavy_jobs()
+    with jobs['lock']:
+        if jobs['flights'].get(('export', key)) is flight:
+            del jobs['flights'][('export', key)]
+    finish_heavy(flight['ticket'])
+    if future.cancelled():
+        flight['path'].unlink(missing_ok=True)
+
+def release_export(job):
+    # Returns whether this was the last session waiting on the job
+    jobs = heavy_jobs()
+    with jobs['lock']:
+        job['flight']['subscribers'] -= 1
+        return job['flight']['subscribers'] == 0
+
+def collect_export(job):
+    # Every session gets its own hard link to the finished file, so dropping one session's
+    # copy never pulls it from under another
+    flight = job['flight']
+    path = new_export_path(flight['suffix'])
+    path.unlink()
+    try:
+        os.link(flight['path'], path)
+    finally:
+        if release_export(job):
+            flight['path'].unlink(missing_ok=True)
+    return path
+
+def cancel_export(job):
+    # Only the last session waiting on a shared job stops it. A queued job is simply dropped;
+    # a running one stops at its next progress report
+    if not release_export(job):
+        return
+    flight, jobs = job['flight'], heavy_jobs()
+    with jobs['lock']:
+        if flight['future'] is None:
+            if jobs['flights'].get(('export', job['key'])) is flight:
+                del jobs['flights'][('export', job['key'])]
+            finish_heavy(flight['ticket'])
+            flight['path'].unlink(missing_ok=True)
+        elif not flight['future'].cancel():
+            flight['state']['cancel'] = True
+
+def cancel_stale_export(report_key):
+    job = st.session_state.get('export_job')
+    if job is not None and job['key'] != report_key:
+        # The filters moved on, so the running export could only be thrown away
+        cancel_export(job)
+        st.session_state.export_job = None
+
+def export_paths_in_use():
+    # Inputs and outputs of every queued or running export job
+    jobs = heavy_jobs()
+    with jobs['lock']:
+        flights = [f for key, f in jobs['flights'].items() if key[0] == 'export']
+    return {f['path'] for f in flights} | {f['input'] for f in flights}
+
+def expired_files(directory, in_use, ttl_hours=EXPORT_TTL_HOURS):
+    # Deletes files untouched for ttl_hours and returns the rest as (mtime, size, path)
+    now = datetime.now().timestamp()
+    entries = []
+    for path in directory.iterdir():
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue  # another session's job removed it
+        if path in in_use:
+            continue
+        if now - stat.st_mtime > ttl_hours * 3600:
+            path.unlink(missing_ok=True)
+        else:
+            entries.append((stat.st_mtime, stat.st_size, path))
+    return entries
+
+def evict_oldest(entries, budget_gb):
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= budget_gb * 1024 ** 3:
+            break
+        path.unlink(missing_ok=True)
+        total -= size
+
+def evict_export_store(keep=()):
+    EXPORT_DIR.mkdir(parents=True, exist_ok=True)
+    EXPORT_INPUT_DIR.mkdir(parents=True, exist_ok=True)
+    in_use = export_paths_in_use() | set(keep)
+    evict_oldest(expired_files(EXPORT_INPUT_DIR, in_use), EXPORT_INPUT_BUDGET_GB)
+    evict_oldest(expired_files(EXPORT_DIR, in_use), EXPORT_STORE_BUDGET_GB)
+
+@st.fragment(run_every=1.0)
+def export_job_panel():
+    # Only this fragment reruns while the session's export is in flight
+    job = st.session_state.get('export_job')
+    if job is None:
+        return
+    flight = job['flight']
+    future = flight['future']
+    if future is None or not future.done():
+        if future is None:
+            st.progress(0.0, text=f"Queued: number {heavy_position(flight['ticket'])} in line for the server.")
+        else:
+            st.progress(flight['state']['done'], text=flight['state']['text'])
+        if st.button("✖ Cancel Export"):
+            cancel_export(job)
+            st.session_state.export_job = None
+            st.rerun()
+        return
+    st.session_state.export_job = None
+    error = future.exception() if not future.cancelled() else CancelledError()
+    if error is None:
+        try:
+            path = collect_export(job)
+        except OSError as e:
+            error = e
+    else:
+        release_export(job)
+    if error is None:
+        prepared = st.session_state.setdefault('prepared_reports', {})
+        prepared[job['key']] = path
+        for stale in list(prepared)[:-REPORT_CACHE_ENTRIES]:
+            prepared.pop(stale).unlink(missing_ok=True)
+        evict_export_store()
+    elif not isinstance(error, CancelledError):
+        st.session_state.export_error = f"Export failed: {error}"
+    st.rerun()
+
+# --- AGGREGATION ENGINE: reruns aggregated in persistent worker processes ---
+# Each worker memory-maps the preprocessed Arrow file (the page cache is shared by all of them) and
+# keeps its own stage memo, so a rerun ships a small spec in and a station-sized result out, and a
+# big cold aggregation no longer holds the GIL every other session's script thread needs.
+# 0 runs the engine on the script thread.
+ENGINE_PROCESSES = int(os.environ.get('CYCLE_ENGINE_PROCESSES', 0))
+
+@st.cache_resource
+def engine_pool():
+    # One single-process executor per worker, so a dataset's reruns can be routed to the worker
+    # already holding its stages
+    context = worker_context()
+    return [ProcessPoolExecutor(max_workers=1, mp_context=context) for _ in range(ENGINE_PROCESSES)]
+
+def run_aggregate(df, dataset_key, spec):
+    if not ENGINE_PROCESSES:
+        return aggregate(df, dataset_key, spec, SERVER_STAGES)
+    pools = engine_pool()
+    window_key = (dataset_key, spec['program'], spec['svs'], spec['start_date'], spec['end_date'], spec['hour_range'])
+    pool = pools[hash(window_key) % len(pools)]
+    try:
+        return pool.submit(engine_aggregate, str(job_input_path(df, dataset_key)), dataset_key, spec).result()
+    except BrokenProcessPool:
+        # A worker died (e.g. out of memory); start fresh workers next rerun and answer this one here
+        for pool in pools:
+            pool.shutdown(wait=False)
+        engine_pool.clear()
+        return aggregate(df, dataset_key, spec, SERVER_STAGES)
 
 def main():
     st.title("Station Cycle Time Analyzer")
     
+    if is_admin():
+        dataset_cache_panel()
+        heavy_jobs_panel()
+    st.sidebar.header("Data Source")
+    data_dir = None
+    if DATA_DIR and st.sidebar.radio("Source", ["Upload", "Server Directory"], horizontal=True) == "Server Directory":
+        data_dir = DATA_DIR
+        st.sidebar.caption(f"Reading partitions from `{DATA_DIR}`")
+
     # FIXED: Accepts .parquet files and allows selection in file explorer
-    uploaded_file = st.file_uploader("Upload Data (Parquet Format)", type=["parquet"])
+    uploaded_files = None if data_dir else st.file_uploader(
+        "Upload Data (Parquet Format)", type=["parquet"], accept_multiple_files=True,
+        help="Several files are merged; when a cycle appears in more than one, the file that sorts last by name wins.")
 
-    if uploaded_file:
-        df = load_data(uploaded_file)
+    if uploaded_files or data_dir:
+        # The server directory is always scanned; it can be far larger than memory
+        if data_dir:
+            source, scan_mode = data_dir, True
+            fingerprint = directory_fingerprint(data_dir)
+            st.sidebar.caption(f"Scanned by program and date. Duplicate cycles are resolved within {SCAN_DEDUPE_PAD_DAYS} "
+                               "days of the range; a cycle re-logged further outside it keeps its in-range record.")
+        else:
+            source = sorted(uploaded_files, key=lambda f: f.name)
+            scan_mode = st.sidebar.checkbox("Scan Mode (filter while reading)",
+                                            help="Push the program and date filters into the Parquet read. "
+                                                 "Row groups that cannot match are never decoded. Duplicate cycles are "
+                                                 f"resolved within {SCAN_DEDUPE_PAD_DAYS} days of the range; a cycle "
+                                                 "re-logged further outside it keeps its in-range record here, "
+                                                 "where a full load keeps only the later one.")
+            budget_mb = st.sidebar.number_input("Load Memory Budget (MB)", min_value=64, value=INGEST_BUDGET_MB, step=64,
+                                                help="Working memory for decoding the file batch by batch.")
+            fingerprint = dataset_fingerprint(source)
+        try:
+            if scan_mode:
+                catalog = load_catalog(source, fingerprint)
+                progs, all_svs = catalog['programs'], catalog['sv_tags']
+                min_date, max_date = catalog['min_date'], catalog['max_date']
+            else:
+                waiting = st.empty()
+                df, load_stats = cached_dataset(
+                    ('upload', fingerprint), ', '.join(f.name for f in source), partial(upload_cost, source, fingerprint),
+                    partial(load_with_spinner, "Unpacking Parquet Data...", load_data, source, fingerprint, int(budget_mb)),
+                    on_wait=waiting.info)
+                waiting.empty()
+                progs = list(program_partitions(df))
+                all_svs = sv_tags_present(df)
+                min_date, max_date = df['step_start_utc1'].min().date(), df['step_start_utc1'].max().date()
+        except ValueError as e:
+            st.error(str(e))
+            return
 
         # --- SIDEBAR FILTERS ---
         st.sidebar.header("Global Filters")
-        progs = sorted(df['mainprogram_name1'].unique())
         selected_program = st.sidebar.selectbox("Main Program", progs)
-        
-        all_svs = sorted(df['sv_tag'].unique())
         selected_svs = st.sidebar.multiselect("Select SVs to Analyze", all_svs, default=all_svs)
         
-        min_date, max_date = df['step_start_utc1'].min().date(), df['step_start_utc1'].max().date()
         selected_dates = st.sidebar.date_input("Date Range", value=(min_date, max_date))
         hour_range = st.sidebar.slider("Hour Range", value=(time(0, 0), time(23, 59)), format="HH:mm")
 
@@ -81,6 +1109,7 @@ def main():
         noise_range = st.sidebar.slider("Range adjustment", 0, 1000, (int(n_min), int(n_max)))
 
         goal_time = st.sidebar.number_input("Goal (s)", value=120)
+        quantiles = tuple(st.sidebar.multiselect("Tail Quantiles", list(TAIL_QUANTILES), default=['P90', 'P95']))
 
         # --- DATA PROCESSING ---
         if isinstance(selected_dates, (tuple, list)) and len(selected_dates) == 2:
@@ -88,23 +1117,36 @@ def main():
         else:
             start_date = end_date = selected_dates
 
-        mask = (df['mainprogram_name1'] == selected_program) & \
-               (df['sv_tag'].isin(selected_svs)) & \
-               (df['step_start_utc1'].dt.date >= start_date) & \
-               (df['step_start_utc1'].dt.date <= end_date) & \
-               (df['step_start_utc1'].dt.time >= hour_range[0]) & \
-               (df['step_start_utc1'].dt.time <= hour_range[1])
-        
-        df_filtered = df[mask].copy()
-        df_filtered = df_filtered[(df_filtered['total_cycle_time_secs1'] >= noise_range[0]) & 
-                                  (df_filtered['total_cycle_time_secs1'] <= noise_range[1])]
+        if scan_mode:
+            waiting = st.empty()
+            try:
+                df, load_stats = cached_dataset(
+                    ('scan', fingerprint, selected_program, start_date, end_date), f"{selected_program} {start_date}–{end_date}",
+                    partial(scan_cost, source, selected_program, start_date, end_date),
+                    partial(load_with_spinner, "Scanning Parquet Data...", load_data_scan, source, selected_program, start_date, end_date),
+                    on_wait=waiting.info)
+            except ValueError as e:
+                st.error(str(e))
+                return
+            waiting.empty()
+        show_load_stats(load_stats)
 
-        # --- STATION VISIBILITY ---
+        # Program and date range select a contiguous slice; SV and hour are fused into one mask over it
+        dataset_key = ('scan', fingerprint, selected_program, start_date, end_date) if scan_mode else ('upload', fingerprint)
+        window_key = (dataset_key, selected_program, tuple(selected_svs), start_date, end_date, tuple(hour_range))
+        band_key = window_key + (tuple(noise_range),)
         if 'ignored_stations' not in st.session_state: 
             st.session_state.ignored_stations = set()
+        ignored = tuple(sorted(st.session_state.ignored_stations))
+        visible_key = band_key + (ignored,)
+        spec = {'program': selected_program, 'svs': tuple(selected_svs), 'start_date': start_date, 'end_date': end_date,
+                'hour_range': tuple(hour_range), 'noise_range': tuple(noise_range), 'ignored': ignored,
+                'quantiles': quantiles, 'goal': goal_time}
+        result = run_aggregate(df, dataset_key, spec)
+        present, summary, share_above, allocations = result['present'], result['summary'], result['share_above'], result['allocations']
 
-        all_stations = df_filtered['station_name1'].unique().tolist()
-        active_list = sort_by_station_number([s for s in all_stations if s not in st.session_state.ignored_stations])
+        # --- STATION VISIBILITY ---
+        active_list = [s for s in present if s not in st.session_state.ignored_stations]
         
         st.subheader("Station Visibility Manager")
         to_hide = st.multiselect("Select stations to hide:", active_list)
@@ -116,15 +1158,20 @@ def main():
             st.session_state.ignored_stations = set()
             st.rerun()
 
-        df_final = df_filtered[~df_filtered['station_name1'].isin(st.session_state.ignored_stations)].copy()
+        def raw_rows():
+            window, slice_rows = stage_window(df, window_key)
+            rows = stage_band(df, window, window_key, tuple(noise_range))
+            rows_final = stage_visible(df, rows, band_key, ignored)
+            return rows_final, {
+                'Filter mask (slice)': slice_rows,
+                'Window row index': window.nbytes,
+                'Noise band row index': rows.nbytes,
+                'Visible row index': rows_final.nbytes,
+                'Aggregation inputs': len(rows_final) * (df['station_name1'].cat.codes.dtype.itemsize +
+                                                      df['total_cycle_time_secs1'].dtype.itemsize),
+            }
 
-        if not df_final.empty:
-            df_final['station_name1'] = df_final['station_name1'].cat.remove_unused_categories()
-            
-            # Grouping and calculating Median
-            summary = df_final.groupby(['station_name1', 'sv_tag'], observed=True)['total_cycle_time_secs1'].agg(['median', 'count']).reset_index()
-            summary['sort_key'] = summary['station_name1'].apply(extract_numeric_suffix)
-            summary = summary.sort_values('sort_key')
+        if len(summary):
 
             total_samples = int(summary['count'].sum()) 
             raw_bottleneck = summary['median'].max()
@@ -137,26 +1184,61 @@ def main():
             m3.metric("Bottleneck (+15%)", f"{bottleneck_buffered:.1f}s")
 
             # --- CHART ---
-            fig = px.bar(summary, x='station_name1', y='median', color='sv_tag', text_auto='.1f', template="plotly_dark")
-            fig.add_hline(y=goal_time, line_color="green", annotation_text="Goal")
-            fig.add_hline(y=bottleneck_buffered, line_dash="dash", line_color="orange")
+            # Only the chart and the above-goal share depend on the goal, so moving it skips every stage above
+            fig = stage_chart(summary, visible_key, goal_time, bottleneck_buffered)
             st.plotly_chart(fig, use_container_width=True)
 
             # --- NEW: SAMPLES QUANTITY TABLE ---
             st.subheader("📊 Station Sample Quantities")
-            display_table = summary[['station_name1', 'sv_tag', 'count', 'median']].copy()
-            display_table.columns = ['Station Name', 'SV Unit', 'Unique Cycles (Qty)', 'Median CT (s)']
-            st.dataframe(display_table, use_container_width=True, hide_index=True)
+            display_table = summary[['station_name1', 'sv_tag', 'count', 'median', *quantiles]].copy()
+            display_table.columns = ['Station Name', 'SV Unit', 'Unique Cycles (Qty)', 'Median CT (s)',
+                                     *[f"{name} CT (s)" for name in quantiles]]
+            column_config = {name: st.column_config.NumberColumn(format="%.2f") for name in display_table.columns[3:]}
+            display_table['Above Goal (%)'] = share_above * 100
+            column_config['Above Goal (%)'] = st.column_config.NumberColumn(format="%.1f%%")
+            st.dataframe(display_table, use_container_width=True, hide_index=True, column_config=column_config)
 
-            excel_file = convert_df_to_excel(df_final, summary)
-            st.download_button(label="📥 Download Excel Report", data=excel_file, file_name="Report.xlsx")
+            # --- REPORT ---
+            # Reports are built only on request, once per filter key; the summary also depends on the quantile panel
+            # File paths are kept in session state, the files themselves in the export store
+            export_format = st.selectbox("Report Format", list(EXPORT_FORMATS),
+                                         help="Excel is the slowest and largest; Parquet and the zip bundle are the fastest.")
+            suffix = EXPORT_FORMATS[export_format][0]
+            report_key = visible_key + (quantiles, export_format)
+            prepared = st.session_state.setdefault('prepared_reports', {})
+            cancel_stale_export(report_key)
+            if 'export_error' in st.session_state:
+                st.error(st.session_state.pop('export_error'))
+            if report_key in prepared and prepared[report_key].exists():
+                # The file is only read when the button is clicked
+                st.download_button(label=f"📥 Download {export_format}", data=partial(prepared[report_key].read_bytes),
+                                   file_name="Report" + suffix, on_click='ignore')
+            else:
+                if st.session_state.get('export_job') is None and st.button("📄 Prepare Report"):
+                    # Only the export needs the raw rows themselves; the file is written by a worker process
+                    rows_final, raw_allocations = raw_rows()
+                    allocations.update(raw_allocations)
+                    settings = {'program': selected_program, 'sv_tags': selected_svs, 'start_date': start_date,
+                                'end_date': end_date, 'hour_range': hour_range, 'noise_range': noise_range,
+                                'hidden_stations': ignored, 'tail_quantiles': quantiles}
+                    st.session_state.export_job = submit_export(export_format, df, dataset_key, rows_final,
+                                                                summary, settings, report_key)
+                if st.session_state.get('export_job') is not None:
+                    export_job_panel()
         else:
+            cancel_stale_export(None)
             st.warning("No data matches selected filters.")
 
+        with st.expander("Debug: Rerun Allocations"):
+            st.dataframe(pd.DataFrame({'Stage': list(allocations), 'Bytes': [format_bytes(n) for n in allocations.values()]}),
+                         hide_index=True)
+            st.caption(f"Total {format_bytes(sum(allocations.values()))} for {int(summary['count'].sum()):,} visible cycles")
+
         # CLEAN UP RAM
-        del df_filtered
-        del df_final
         gc.collect() 
+    else:
+        # Nothing to look at, so the dataset this session had open is free to evict
+        release_dataset()
 
 if __name__ == "__main__":
     main()
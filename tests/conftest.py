@@ -0,0 +1,31 @@
+# The app is a script at the repo root, imported here in Streamlit's bare mode
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import report_copy_5 as app
+
+@pytest.fixture
+def jobs():
+    # A fresh server-wide scheduler for every test
+    app.heavy_jobs.clear()
+    yield app.heavy_jobs()
+    app.heavy_jobs.clear()
+
+@pytest.fixture(scope='session')
+def export_pool():
+    pool, manager = app.export_pool()
+    yield pool, manager
+    pool.shutdown()
+    manager.shutdown()
+    app.export_pool.clear()
+
+@pytest.fixture
+def export_dirs(tmp_path, monkeypatch):
+    import cycle_engine
+    monkeypatch.setattr(app, 'EXPORT_DIR', tmp_path / 'exports')
+    monkeypatch.setattr(cycle_engine, 'EXPORT_DIR', tmp_path / 'exports')
+    monkeypatch.setattr(app, 'EXPORT_INPUT_DIR', tmp_path / 'inputs')
+    return tmp_path
@@ -0,0 +1,53 @@
+import threading
+
+import pytest
+
+import report_copy_5 as app
+
+@pytest.fixture
+def cache(monkeypatch, jobs):
+    app.dataset_cache.clear()
+    cache = app.dataset_cache()
+    cache['budget'] = 100
+    monkeypatch.setattr(app, 'DATASET_QUEUE_SECONDS', 2)
+    session = threading.local()
+    monkeypatch.setattr(app, 'session_id', lambda: getattr(session, 'id', None))
+    cache['session'] = session
+    yield cache
+    app.dataset_cache.clear()
+
+def load(cache, session, key, nbytes, calls=None):
+    cache['session'].id = session
+
+    def loader():
+        if calls is not None:
+            calls.append(key)
+        return key, {'frame_bytes': nbytes}
+
+    return app.cached_dataset(key, key, lambda: (nbytes, 1), loader)
+
+def test_one_session_switches_between_datasets_that_do_not_fit_together(cache):
+    load(cache, 's1', 'A', 60)
+    load(cache, 's1', 'B', 60)
+    assert list(cache['entries']) == ['B']
+
+def test_a_dataset_held_by_another_session_is_not_evicted(cache):
+    load(cache, 's1', 'A', 60)
+    with pytest.raises(ValueError, match="busy"):
+        load(cache, 's2', 'B', 60)
+    assert list(cache['entries']) == ['A']
+    # Once s1 moves on, s2 gets its turn
+    cache['session'].id = 's1'
+    app.release_dataset()
+    load(cache, 's2', 'B', 60)
+    assert list(cache['entries']) == ['B']
+
+def test_sessions_share_one_load_and_hold_it_together(cache):
+    calls = []
+    assert load(cache, 's1', 'A', 40, calls) is load(cache, 's2', 'A', 40, calls)
+    assert calls == ['A']
+    assert set(cache['entries']['A']['holders']) == {'s1', 's2'}
+    # s1 moving on does not free a dataset s2 still looks at, only s1's own
+    load(cache, 's1', 'B', 40)
+    load(cache, 's1', 'C', 40)
+    assert set(cache['entries']) == {'A', 'C'}
@@ -0,0 +1,85 @@
+import time
+from concurrent.futures import CancelledError
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import report_copy_5 as app
+
+def frame(rows):
+    return pd.DataFrame({'station_name1': pd.Categorical(np.arange(rows) % 7),
+                         'total_cycle_time_secs1': np.arange(rows, dtype=float)})
+
+def submit(df, key, label='Parquet (.parquet)'):
+    summary = pd.DataFrame({'station_name1': ['S1'], 'median': [1.0]})
+    return app.submit_export(label, df, ('test', len(df)), np.arange(len(df)), summary, {}, key)
+
+def wait_for(condition, timeout=60):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.05)
+
+@pytest.fixture
+def blocked(jobs):
+    # Holds every CPU slot, so exports submitted meanwhile stay queued until it is finished
+    blocker = app.heavy_ticket('blocker', app.HEAVY_CPU_SLOTS, 0, lambda: None)
+    app.enqueue_heavy(blocker)
+    yield blocker
+    app.finish_heavy(blocker)
+
+def test_cancel_while_queued(export_pool, export_dirs, jobs, blocked):
+    job = submit(frame(1_000), 'report')
+    flight = job['flight']
+    assert app.heavy_position(flight['ticket']) == 1
+    app.cancel_export(job)
+    assert flight['future'] is None
+    assert jobs['flights'] == {}
+    assert app.heavy_position(flight['ticket']) == 0
+    assert not flight['path'].exists()
+    # Finishing the blocker must not start the withdrawn job
+    app.finish_heavy(blocked)
+    assert flight['future'] is None and jobs['running'] == []
+
+def test_cancel_while_running(export_pool, export_dirs, jobs):
+    # Big enough that the workbook is still being written when the cancel lands
+    job = submit(frame(150_000), 'report', 'Excel (.xlsx)')
+    flight = job['flight']
+    wait_for(lambda: flight['future'] is not None and flight['future'].running())
+    app.cancel_export(job)
+    assert flight['state']['cancel']
+    assert isinstance(flight['future'].exception(timeout=60), CancelledError)
+    wait_for(lambda: jobs['flights'] == {} and jobs['running'] == [])
+    assert not flight['path'].exists()
+
+def test_subscribers_share_one_job_across_sessions(export_pool, export_dirs, jobs, blocked):
+    df = frame(1_000)
+    first, second = submit(df, 'report'), submit(df, 'report')
+    flight = first['flight']
+    assert second['flight'] is flight and flight['subscribers'] == 2
+    assert len(jobs['queue']) == 1 and app.heavy_position(flight['ticket']) == 1
+
+    # One session leaving does not stop the job the other still waits on
+    app.cancel_export(first)
+    assert flight['subscribers'] == 1
+    assert jobs['flights'][('export', 'report')] is flight
+    assert flight['path'].exists()
+
+    app.finish_heavy(blocked)
+    wait_for(lambda: flight['future'] is not None and flight['future'].done())
+    assert flight['future'].exception() is None
+    path = app.collect_export(second)
+    assert path.exists() and path != flight['path']
+    assert pd.read_parquet(path)['total_cycle_time_secs1'].sum() == df['total_cycle_time_secs1'].sum()
+    # The last subscriber's copy is all that is left of the shared file
+    assert not flight['path'].exists()
+
+def test_last_subscriber_cancels_the_job(export_pool, export_dirs, jobs, blocked):
+    first, second = submit(frame(1_000), 'report'), submit(frame(1_000), 'report')
+    flight = first['flight']
+    app.cancel_export(first)
+    app.cancel_export(second)
+    assert flight['subscribers'] == 0
+    assert jobs['flights'] == {}
+    assert not flight['path'].exists()
@@ -0,0 +1,126 @@
+import threading
+import time
+
+import pytest
+from streamlit.runtime.scriptrunner_utils.exceptions import StopException
+
+import report_copy_5 as app
+
+def run_in_thread(fn):
+    out = {}
+
+    def run():
+        try:
+            out['result'] = fn()
+        except BaseException as e:
+            out['error'] = e
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread, out
+
+def start_owner(jobs, key, compute):
+    # Returns once the owner's flight is registered, so the next request for key waits on it
+    owner = run_in_thread(lambda: app.single_flight(key, compute))
+    while key not in jobs['flights']:
+        time.sleep(0.01)
+    return owner
+
+def test_single_flight_collapses_identical_requests(jobs):
+    calls, release, waiting = [], threading.Event(), threading.Event()
+
+    def compute():
+        calls.append(1)
+        release.wait(10)
+        return object()
+
+    owner, owner_out = start_owner(jobs, 'key', compute)
+    waiter, waiter_out = run_in_thread(lambda: app.single_flight('key', compute, on_wait=lambda text: waiting.set()))
+    assert waiting.wait(10)
+    release.set()
+    owner.join(10)
+    waiter.join(10)
+    assert len(calls) == 1
+    assert waiter_out['result'] is owner_out['result']
+    assert jobs['flights'] == {}
+
+def test_single_flight_waiter_takes_over_a_stopped_run(jobs):
+    waiting = threading.Event()
+
+    def stopped():
+        # The owner's script run is stopped mid-computation, as Streamlit does on a rerun
+        waiting.wait(10)
+        raise StopException()
+
+    owner, owner_out = start_owner(jobs, 'key', stopped)
+    waiter, waiter_out = run_in_thread(lambda: app.single_flight('key', lambda: 'computed by the waiter',
+                                                                  on_wait=lambda text: waiting.set()))
+    owner.join(10)
+    waiter.join(10)
+    assert isinstance(owner_out['error'], StopException)
+    assert waiter_out['result'] == 'computed by the waiter'
+    assert jobs['flights'] == {}
+
+def test_single_flight_waiter_sees_the_owners_failure(jobs):
+    waiting = threading.Event()
+
+    def failing():
+        waiting.wait(10)
+        raise ValueError("bad file")
+
+    owner, _ = start_owner(jobs, 'key', failing)
+    waiter, waiter_out = run_in_thread(lambda: app.single_flight('key', lambda: 'never run',
+                                                                  on_wait=lambda text: waiting.set()))
+    owner.join(10)
+    waiter.join(10)
+    assert str(waiter_out['error']) == "bad file"
+
+@pytest.fixture
+def caps(monkeypatch):
+    monkeypatch.setattr(app, 'HEAVY_CPU_SLOTS', 4)
+    monkeypatch.setattr(app, 'HEAVY_MEMORY_GB', 1)
+
+def ticket(started, label, cpu=1, gb=0.0):
+    return app.heavy_ticket(label, cpu, int(gb * 1024 ** 3), lambda: started.append(label))
+
+def test_dispatch_is_first_come_first_served_under_the_cpu_cap(jobs, caps):
+    started = []
+    wide, big, small = ticket(started, 'wide', cpu=3), ticket(started, 'big', cpu=2), ticket(started, 'small')
+    for t in (wide, big, small):
+        app.enqueue_heavy(t)
+    # small fits next to wide but must not overtake big
+    assert started == ['wide']
+    assert [app.heavy_position(t) for t in (wide, big, small)] == [0, 1, 2]
+    app.finish_heavy(wide)
+    assert started == ['wide', 'big', 'small']
+    assert jobs['queue'] == []
+
+def test_dispatch_is_first_come_first_served_under_the_memory_cap(jobs, caps):
+    started = []
+    first, huge, small = ticket(started, 'first', gb=0.5), ticket(started, 'huge', gb=3), ticket(started, 'small', gb=0.1)
+    for t in (first, huge, small):
+        app.enqueue_heavy(t)
+    assert started == ['first']
+    # A job bigger than the whole cap runs once it has the server to itself, then the rest follow
+    app.finish_heavy(first)
+    assert started == ['first', 'huge']
+    app.finish_heavy(huge)
+    assert started == ['first', 'huge', 'small']
+
+def test_heavy_slot_waits_for_room(jobs, caps):
+    started = []
+    blocker = ticket(started, 'blocker', cpu=4)
+    app.enqueue_heavy(blocker)
+    entered = threading.Event()
+
+    def job():
+        with app.heavy_slot('queued job', 1, 0):
+            entered.set()
+
+    thread, _ = run_in_thread(job)
+    assert not entered.wait(0.5)
+    assert app.heavy_position(jobs['queue'][0]) == 1
+    app.finish_heavy(blocker)
+    assert entered.wait(10)
+    thread.join(10)
+    assert jobs['queue'] == [] and jobs['running'] == []